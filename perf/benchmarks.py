@@ -1,7 +1,9 @@
-import re
+import functools
 import sys
 import timeit
 
+from fdict import fdict
+
 ### UTILS
 def timeit_auto(stmt="pass", setup="pass", repeat=3):
     """
@@ -11,6 +13,9 @@ def timeit_auto(stmt="pass", setup="pass", repeat=3):
     Runs enough loops so that total execution time is greater than 0.2 sec,
     and then repeats that 3 times and keeps the lowest value.
 
+    stmt and setup can be strings of code or zero-argument callables (called
+    directly, without compiling any source).
+
     Returns the number of loops and the time for each loop in microseconds
     """
     t = timeit.Timer(stmt, setup)
@@ -40,10 +45,11 @@ def format_sizeof(num):
     return '{0:3.2f} '.format(num) + unit
 
 ### BENCHMARKS
-try:
-    _range = xrange
-except NameError as exc:
-    _range = range
+
+def _key_strings(breadth=5):
+    '''Build the table of the keys strings '0' to str(breadth) once per benchmark call, interned so their hash is computed only once.
+    Formatting str(j) at each access would allocate and hash a new string every time, adding noise to what is measured (and differently across interpreters, eg, PyPy caches the str() of small ints but CPython does not)'''
+    return [sys.intern(str(j)) for j in range(breadth+1)]
 
 def benchmark_set(dclass, breadth=5, depth=1000, args=None, kwargs=None):
     '''Test performance of setitem with indirect access of nested elements (eg: x['a']['b']['c'])'''
@@ -53,12 +59,15 @@ def benchmark_set(dclass, breadth=5, depth=1000, args=None, kwargs=None):
         kwargs = {}
 
     d = dclass(*args, **kwargs)
+    # The descent below is what is measured (for fdict, each di[key] on a node creates a nested fdict), not str()
+    jstrs = _key_strings(breadth)
+    nodekey = jstrs[breadth]
     di = d
-    for _ in _range(depth):
-        for j in _range(breadth):
-            di[str(j)] = j
-        di[str(breadth)] = {}
-        di = di[str(breadth)]
+    for _ in range(depth):
+        for j in range(breadth):
+            di[jstrs[j]] = j
+        di[nodekey] = {}
+        di = di[nodekey]
     return d
 
 def benchmark_get(dclass, breadth=5, depth=1000, d=None, args=None, kwargs=None):
@@ -70,14 +79,31 @@ def benchmark_get(dclass, breadth=5, depth=1000, d=None, args=None, kwargs=None)
 
     if d is None:
         d = benchmark_set(dclass, breadth=breadth, depth=depth, args=args, kwargs=kwargs)
+    jstrs = _key_strings(breadth)
+    leafkeys = jstrs[:breadth]
+    nodekey = jstrs[breadth]
     di = d
-    for _ in _range(depth):
-        for j in _range(breadth):
-            x = di[str(j)]
+    for _ in range(depth):
+        for key in leafkeys:
+            x = di[key]
             x += 1
-        di = di[str(breadth)]
+        di = di[nodekey]
     return d
 
+@functools.lru_cache(maxsize=None)
+def _direct_keys(breadth=5, depth=1000, delimiter='/'):
+    '''Build the full keys used by the direct access benchmarks, as a tuple per depth level of breadth keys.
+    The keys are built only once per shape (breadth, depth and delimiter) and then reused by all the runs, so that the benchmark loops measure the dict access and not the strings concatenation (each key would otherwise be rebuilt, and so rehashed, on every access).
+    Tuples since the cached keys are shared by all the runs.'''
+    jstrs = _key_strings(breadth)
+    levels = []
+    prefix = ''
+    for i in range(depth):
+        levels.append(tuple([prefix+jstrs[j] for j in range(breadth)]))
+        # The prefix of the next level is only extended once per level
+        prefix = prefix+jstrs[breadth]+delimiter
+    return tuple(levels)
+
 def benchmark_set_direct(dclass, breadth=5, depth=1000, delimiter='/', args=None, kwargs=None):
     '''Test performance of setitem with direct access of nested elements (using strings with delimiter, eg: x['a/b/c'])'''
     if args is None:
@@ -86,12 +112,9 @@ def benchmark_set_direct(dclass, breadth=5, depth=1000, delimiter='/', args=None
         kwargs = {}
 
     d = dclass(*args, **kwargs)
-    rootpath = ''
-    for i in _range(depth):
-        delim = (delimiter if i>0 else '')
-        for j in _range(breadth):
-            d[rootpath+delim+str(j)] = j
-        rootpath += delim+str(breadth)
+    for keys in _direct_keys(breadth=breadth, depth=depth, delimiter=delimiter):
+        for j in range(breadth):
+            d[keys[j]] = j
     return d
 
 def benchmark_get_direct(dclass, breadth=5, depth=1000, d=None, delimiter='/', args=None, kwargs=None):
@@ -103,17 +126,23 @@ def benchmark_get_direct(dclass, breadth=5, depth=1000, d=None, delimiter='/', a
 
     if d is None:
         d = benchmark_set_direct(dclass, breadth=breadth, depth=depth, delimiter=delimiter, args=args, kwargs=kwargs)
-    rootpath = ''
-    for i in _range(depth):
-        delim = (delimiter if i>0 else '')
-        for j in _range(breadth):
-            x = d[rootpath+delim+str(j)]
+    for keys in _direct_keys(breadth=breadth, depth=depth, delimiter=delimiter):
+        for key in keys:
+            x = d[key]
             x += 1
-        rootpath += delim+str(breadth)
     return d
 
+def benchmark_roundtrip(dclass, breadth=5, depth=1000, direct=False, delimiter='/', args=None, kwargs=None):
+    '''Test performance of setitem then getitem on the same dict, while it is still hot in cache, with indirect access (eg: x['a']['b']['c']) or direct access if direct is True (eg: x['a/b/c'])'''
+    if direct:
+        d = benchmark_set_direct(dclass, breadth=breadth, depth=depth, delimiter=delimiter, args=args, kwargs=kwargs)
+        return benchmark_get_direct(dclass, breadth=breadth, depth=depth, d=d, delimiter=delimiter)
+    else:
+        d = benchmark_set(dclass, breadth=breadth, depth=depth, args=args, kwargs=kwargs)
+        return benchmark_get(dclass, breadth=breadth, depth=depth, d=d)
+
 def benchmark_viewitems_dict(dclass, breadth=5, depth=1000, d=None, args=None, kwargs=None):
-    '''Test performance of viewitems on dict'''
+    '''Test performance of viewitems on dict (ie, items(), which is a view on Python 3)'''
     if args is None:
         args = []
     if kwargs is None:
@@ -121,12 +150,14 @@ def benchmark_viewitems_dict(dclass, breadth=5, depth=1000, d=None, args=None, k
 
     if d is None:
         d = benchmark_set(dclass, breadth=breadth, depth=depth, args=args, kwargs=kwargs)
+    nodekey = _key_strings(breadth)[breadth]
     x = 0
     di = d
-    for _ in _range(depth):
-        for _ in di.viewitems():
-            x += 1
-        di = di[str(breadth)]
+    for _ in range(depth):
+        # Count with fdict's helper, which consumes the items at C speed so that counting does not add a Python-level loop to what is measured (the iteration itself)
+        # iter() since the helper would just return len() for a sized view, without iterating
+        x += fdict._count_iter_items(iter(di.items()))
+        di = di[nodekey]
     return x
 
 def benchmark_viewitems_fdict(dclass, breadth=5, depth=1000, d=None, args=None, kwargs=None):
@@ -138,79 +169,79 @@ def benchmark_viewitems_fdict(dclass, breadth=5, depth=1000, d=None, args=None,
 
     if d is None:
         d = benchmark_set_direct(dclass, breadth=breadth, depth=depth, args=args, kwargs=kwargs)
+    nodekey = _key_strings(breadth)[breadth]
     x = 0
     di = d
-    for _ in _range(depth):
-        for _ in di.viewitems():
-            x += 1
-        di = di[str(breadth)]
+    for _ in range(depth):
+        x += fdict._count_iter_items(di.viewitems())
+        di = di[nodekey]
     return x
 
-### DEFINE BENCHMARKS
-
-tests = '''
-### setitem and getitem indirect access, eg, x['a']['b']['c']
-## dict
-# setitem
-benchmark_set(dict, depth=100)
-# getitem+setitem
-benchmark_get(dict, depth=100, d=benchmark_set(dict, depth=100))
-## fdict
-# setitem
-benchmark_set(fdict, depth=100)
-# getitem+setitem
-benchmark_get(fdict, depth=100, d=benchmark_set(fdict, depth=100))
-## fdict fastview (skipped because too slow! setitem runs in quadratic time because of metadata building, but can be optimized to run in linear time!)
-# setitem
-#benchmark_set(fdict, depth=100, kwargs={'fastview': True})
-# getitem+setitem
-#benchmark_get(fdict, depth=100, d=benchmark_set(fdict, depth=100, kwargs={'fastview': True}))
-
-### setitem and getitem direct access, eg, x['a/b/c']
-## dict
-# setitem
-benchmark_set_direct(dict, depth=100)
-# getitem+setitem
-benchmark_get_direct(dict, depth=100, d=benchmark_set_direct(dict, depth=100))
-## fdict
-# setitem
-benchmark_set_direct(fdict, depth=100)
-# getitem+setitem
-benchmark_get_direct(fdict, depth=100, d=benchmark_set_direct(fdict, depth=100))
-## fdict fastview
-# setitem
-#benchmark_set_direct(fdict, depth=100, kwargs={'fastview': True})
-# getitem+setitem
-#benchmark_get_direct(fdict, depth=100, d=benchmark_set_direct(fdict, depth=100, kwargs={'fastview': True}))
-
-### viewitem
-## dict
-benchmark_viewitems_dict(dict, breadth=100, depth=5, d=benchmark_set(dict, breadth=100, depth=5))
-## fdict
-benchmark_viewitems_fdict(fdict, breadth=100, depth=5, d=benchmark_set_direct(fdict, breadth=100, depth=5))
-## fdict fastview
-#benchmark_viewitems_fdict(fdict, breadth=100, depth=5, d=benchmark_set_direct(fdict, breadth=100, depth=5, kwargs={'fastview': True}))
-
-'''
-
-### RUN BENCHMARKS
-# Get all functions starting with 'benchmark_'
-all_benchmarks = ', '.join([s for s in dir() if s.startswith('benchmark_')])
-
-# Extract statements from the tests docstring
-tests_stmts = [x for x in  re.split(r'\s+(#+.+?\n)(?=[^#])', tests, flags=(re.M | re.S)) if x.strip()]
+def benchmark_len(dclass, breadth=5, depth=1000, d=None, args=None, kwargs=None):
+    '''Test performance of len() at each nested level, O(1) for dict but fdict has to count the leaves under the nested level'''
+    if args is None:
+        args = []
+    if kwargs is None:
+        kwargs = {}
 
-# Build the setup string (imports etc) for the timeit
-setupstr = 'from fdict import fdict, sfdict\nfrom __main__ import %s' % all_benchmarks
+    if d is None:
+        d = benchmark_set(dclass, breadth=breadth, depth=depth, args=args, kwargs=kwargs)
+    nodekey = _key_strings(breadth)[breadth]
+    x = 0
+    di = d
+    for _ in range(depth):
+        x += len(di)
+        di = di[nodekey]
+    return x
 
-for test in tests_stmts:
-    if test[0] == '#':
-        # Comment, just print it
-        print(test.strip('\n'))
-        continue
-    else:
-        # A real test statement, we process it
-        num, timing = timeit_auto(setup=setupstr, stmt=test)
-        print('%i loops, best of 3: %s' % (num, format_sizeof(timing)))
+### DEFINE BENCHMARKS
+# List of headers (strings, printed as-is) and benchmarks (label, zero-argument callable), run in order
+
+tests = [
+    '### setitem and getitem indirect access, eg, x[\'a\'][\'b\'][\'c\']',
+    '## dict',
+    ('# setitem', lambda: benchmark_set(dict, depth=100)),
+    ('# getitem+setitem', lambda: benchmark_roundtrip(dict, depth=100)),
+    '## fdict',
+    ('# setitem', lambda: benchmark_set(fdict, depth=100)),
+    ('# getitem+setitem', lambda: benchmark_roundtrip(fdict, depth=100)),
+    '## fdict fastview',
+    ('# setitem', lambda: benchmark_set(fdict, depth=100, kwargs={'fastview': True})),
+    ('# getitem+setitem', lambda: benchmark_roundtrip(fdict, depth=100, kwargs={'fastview': True})),
+
+    '### setitem and getitem direct access, eg, x[\'a/b/c\']',
+    '## dict',
+    ('# setitem', lambda: benchmark_set_direct(dict, depth=100)),
+    ('# getitem+setitem', lambda: benchmark_roundtrip(dict, depth=100, direct=True)),
+    '## fdict',
+    ('# setitem', lambda: benchmark_set_direct(fdict, depth=100)),
+    ('# getitem+setitem', lambda: benchmark_roundtrip(fdict, depth=100, direct=True)),
+    '## fdict fastview',
+    ('# setitem', lambda: benchmark_set_direct(fdict, depth=100, kwargs={'fastview': True})),
+    ('# getitem+setitem', lambda: benchmark_roundtrip(fdict, depth=100, direct=True, kwargs={'fastview': True})),
+
+    '### viewitem',
+    ('## dict', lambda: benchmark_viewitems_dict(dict, breadth=100, depth=5, d=benchmark_set(dict, breadth=100, depth=5))),
+    ('## fdict', lambda: benchmark_viewitems_fdict(fdict, breadth=100, depth=5, d=benchmark_set_direct(fdict, breadth=100, depth=5))),
+    ('## fdict fastview', lambda: benchmark_viewitems_fdict(fdict, breadth=100, depth=5, d=benchmark_set_direct(fdict, breadth=100, depth=5, kwargs={'fastview': True}))),
+
+    '### len',
+    ('## dict', lambda: benchmark_len(dict, breadth=100, depth=5, d=benchmark_set(dict, breadth=100, depth=5))),
+    ('## fdict', lambda: benchmark_len(fdict, breadth=100, depth=5, d=benchmark_set_direct(fdict, breadth=100, depth=5))),
+    ]
 
-sys.exit(0)
\ No newline at end of file
+### RUN BENCHMARKS
+if __name__ == '__main__':
+    for test in tests:
+        if isinstance(test, str):
+            # Header, just print it
+            print(test)
+            continue
+        else:
+            # A real benchmark, we time the callable directly
+            label, stmt = test
+            print(label)
+            num, timing = timeit_auto(stmt=stmt)
+            print('%i loops, best of 3: %s' % (num, format_sizeof(timing)))
+
+    sys.exit(0)
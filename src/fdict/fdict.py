@@ -25,12 +25,17 @@
 #
 
 import collections
+import functools
 import itertools
 import os
+import pickle
 import shelve
 import sys
 import tempfile
+import time
+import zlib
 
+from copy import deepcopy
 from pickle import HIGHEST_PROTOCOL as PICKLE_HIGHEST_PROTOCOL
 from types import GeneratorType
 
@@ -42,10 +47,182 @@ if PY3:  # pragma: no cover
 else:
     _zip = itertools.izip
 
+_Mapping = collections.abc.Mapping  # cache the abstract class lookup, used in hot loops
+_mapping_types = {dict: True}  # cache of type -> is it a _Mapping, used by the flattening loops since isinstance(v, _Mapping) goes through the ABC machinery for every value (several times slower than a dict lookup, and most values are leaves)
+
+_MISSING = object()  # sentinel for missing keys, since None might be a stored value
+
+
+@functools.lru_cache(maxsize=4096)
+def _split_path(path, delimiter='/'):
+    '''Split a path into its segments. Memoized since the same paths are split again and again (eg, to find the parents of leaves sharing the same nodes)'''
+    return tuple(path.split(delimiter))
+
+
+@functools.lru_cache(maxsize=4096)
+def _path_prefix(rootpath, delimiter='/'):
+    '''Build the prefix of the full keys below rootpath (ie, rootpath + delimiter). Memoized since a nested fdict is created at each node access, always on the same few rootpaths, and the returned string is interned (so its hash is computed only once)'''
+    return sys.intern('%s%s' % (rootpath, delimiter))
+
 
 __all__ = ['fdict', 'sfdict']
 
 
+class _PathIndex(object):
+    '''
+    Radix-like index of the keys of an internal dict, stored as a dict-of-dicts trie keyed by path segments.
+    Used to find nodes and the keys below them in O(depth) and O(m) instead of walking through all keys, without the setitem overhead of fastview mode.
+    The index is not maintained on changes: it is stored in the keys cache of the internal dict (see _ViewCache), so it is dropped on every change of the keys like the cached lists of keys, and rebuilt on a later lookup (see fdict._get_index()).
+    '''
+    __slots__ = ('delimiter', 'root')
+
+    MINSIZE = 64  # below this number of keys, a scan is faster than building the index
+    _LEAF = object()  # marker of a leaf: the trie node of a leaf that is not also a node, or the key in a trie node that is also a leaf (path segments are always strings so there is no conflict). Shared by all leaves, so that they cost no memory
+
+    def __init__(self, keys, delimiter='/'):
+        '''Build the index of the supplied keys of an internal dict'''
+        self.delimiter = delimiter
+        self.root = root = {}
+        LEAF = self._LEAF
+        dict_ = dict
+        for k in keys:
+            if not isinstance(k, str):
+                # Only string keys can be nested (others are always root leaves, checked directly on the internal dict)
+                continue
+            # Split directly, without going through the _split_path() cache: leaves are unique paths, they would just evict the nodes
+            segs = k.split(delimiter)
+            node = root
+            for i in range(len(segs)-1):
+                seg = segs[i]
+                child = node.get(seg)
+                if child is None:
+                    node[seg] = child = {}
+                elif child is LEAF:
+                    # This leaf is also a node
+                    node[seg] = child = {LEAF: LEAF}
+                node = child
+            seg = segs[-1]
+            child = node.get(seg)
+            if child is None:
+                node[seg] = LEAF
+            elif type(child) is dict_:
+                # This node is also a leaf
+                child[LEAF] = LEAF
+
+    def has_node(self, fullkey):
+        '''Check if there is any key nested below fullkey (ie, any key starting with fullkey+delimiter)'''
+        node = self.root
+        for seg in _split_path(fullkey, self.delimiter):
+            if node is self._LEAF:
+                return False
+            node = node.get(seg)
+            if node is None:
+                return False
+        # Trie nodes are only created with children
+        return node is not self._LEAF
+
+    def keys_below(self, fullkey):
+        '''Get all the full keys nested below fullkey (ie, starting with fullkey+delimiter), in O(m) where m is the number of nested keys, instead of scanning all the keys'''
+        LEAF = self._LEAF
+        node = self.root
+        for seg in _split_path(fullkey, self.delimiter):
+            if node is LEAF:
+                return []
+            node = node.get(seg)
+            if node is None:
+                return []
+        if node is LEAF:
+            return []
+        delimiter = self.delimiter
+        keys = []
+        keys_append = keys.append
+        stack = [(fullkey + delimiter, node)]
+        while stack:
+            prefix, node = stack.pop()
+            for seg, child in node.items():
+                if seg is LEAF:
+                    continue
+                if child is LEAF:
+                    keys_append(prefix + seg)
+                else:
+                    if LEAF in child:
+                        keys_append(prefix + seg)
+                    stack.append((prefix + seg + delimiter, child))
+        return keys
+
+
+class _NodeSetsCopyOnWrite(object):
+    '''
+    Copy-on-write tracker of the fastview nodes sets, shared by all nested fdicts of an internal dict.
+    After a copy(), both the original and the copy's internal dicts point to the same sets objects: instead of copying them all eagerly, a set is copied on its first mutation, so that unmodified nodes cost nothing.
+    '''
+    __slots__ = ('owned',)
+
+    def __init__(self):
+        self.owned = None  # set of nodes whose set was copied (hence owned), or None if no set is shared with a copy
+
+    def share(self):
+        '''Mark all the current nodes sets as shared (ie, not owned anymore), called when the internal dict is copied'''
+        self.owned = set()
+
+    def writable(self, d, node):
+        '''Get the set of a node to modify it, copying it first if it is still shared with a copy'''
+        nodeset = d[node]
+        owned = self.owned
+        if owned is not None and node not in owned:
+            nodeset = nodeset.copy()
+            d[node] = nodeset
+            owned.add(node)
+        return nodeset
+
+
+class _ViewCache(dict):
+    '''
+    Cache of the full keys below the rootpaths recently walked by the view* methods (rootpath + delimiter -> list of full keys), shared by all nested fdicts of an internal dict.
+    Without fastview, listing a nested fdict requires to walk through all the keys of the internal dict: with this cache, this is done only once until the keys change (the cache is cleared on every change).
+    Only the keys are cached, the values are always fetched from the internal dict.
+    The cache is also checked against a fingerprint of the keys of the internal dict before use (see keys_stamp()), so that the keys added by another fdict using the same internal dict (eg, fdict(d=x.d, rootpath='a')) or directly in the internal dict are seen.
+    The keys index is also stored here (under non-string keys, see fdict._get_index()), so that it is dropped with the lists of keys by the same clear() on every change.
+    '''
+    __slots__ = ('d', 'stamp')
+
+    MAXSIZE = 64  # maximum number of cached rootpaths, the lists of keys are all dropped when reached
+
+    def __init__(self):
+        dict.__init__(self)
+        self.d = None  # internal dict that is cached
+        self.stamp = None  # fingerprint of the keys of the internal dict when the cache was (re)started
+
+    @staticmethod
+    def keys_stamp(d):
+        '''Get a cheap fingerprint of the keys of an in-memory internal dict: its size and its last inserted key. Since dicts keep the insertion order, adding a key changes the fingerprint even if another key was deleted meanwhile (same size).'''
+        if not isinstance(d, dict):
+            # Out-of-core dicts are never cached (see fdict._keys_below()), and their len() can be slow
+            return None
+        try:
+            return len(d), next(reversed(d), None)
+        except TypeError:
+            # Python < 3.8: dicts are not reversible, fallback to the size only
+            return len(d)
+
+    def validate(self, d):
+        '''Empty the cache if the internal dict was replaced or if its keys changed without going through the fdict owning this cache'''
+        stamp = self.keys_stamp(d)
+        if self.d is not d or self.stamp != stamp:
+            self.clear()
+            self.d = d
+            self.stamp = stamp
+
+    def store(self, pattern, keys):
+        '''Cache the list of keys below pattern, making room first if the cache is full'''
+        if len(self) >= self.MAXSIZE:
+            # Drop the lists of keys, but keep the index, which is still valid
+            kept = [(k, v) for k, v in self.items() if not isinstance(k, str)]
+            self.clear()
+            self.update(kept)
+        self[pattern] = keys
+
+
 class fdict(dict):
     '''
     Flattened nested dict, all items are settable and gettable through ['item1']['item2'] standard form or ['item1/item2'] internal form.
@@ -54,6 +231,10 @@ class fdict(dict):
 
     Fastview mode: remove conflicts issue and allow for fast O(m) contains(), delete() and view*() (such as vieitems()) where m in the number of subitems, instead of O(n) where n was the total number of elements in the fdict(). Downside is setitem() being O(m) too because of nodes metadata building, and memory/storage overhead, since we store all nodes and leaves lists in order to allow for fast lookup.
     '''
+    # Store the parameters in slots, since a new fdict is created at each access of a node: this reduces the memory of each instance and speeds up attributes access.
+    # __dict__ is kept for subclasses and custom attributes, but it is only allocated if used.
+    __slots__ = ('d', 'rootpath', '_rootpath_prefix', 'delimiter', 'fastview', 'nodel', 'kwargs', '_cow', '_viewcache', '_viewkeys', '_viewvalues', '_viewitems', '__dict__', '__weakref__')
+
     def __init__(self, d=None, rootpath='', delimiter='/', fastview=False, nodel=False, **kwargs):
         '''
         Parameters
@@ -69,7 +250,7 @@ class fdict(dict):
             [default : '/']
         fastview  : bool, optional
             Activates fastview mode, which makes setitem slower
-            in O(m*l) instead of O(1), but makes view* methods
+            in O(m+l) instead of O(1), but makes view* methods
             (viewitem, viewkeys, viewvalues) as fast as dict's.
             [default : False]
         nodel  : bool, optional
@@ -87,9 +268,12 @@ class fdict(dict):
         # Init self parameters
         self.rootpath = rootpath
         self.delimiter = delimiter
+        self._rootpath_prefix = _path_prefix(rootpath, delimiter) if rootpath else ''  # cache the prefix of full keys, used on every item access
         self.fastview = fastview
         self.nodel = nodel
         self.kwargs = kwargs  # store all kwargs for easy subclassing
+        self._cow = _NodeSetsCopyOnWrite()  # fastview nodes sets sharing with copies, shared with nested fdicts
+        self._viewcache = _ViewCache()  # cache of the keys below rootpaths, shared with nested fdicts
 
         if d is not None:
             if rootpath:
@@ -102,25 +286,47 @@ class fdict(dict):
                 else:
                     # if we use a shelve or probably other types of out-of-core dicts, we will get an object that is not a subclass of dict, so we should just trust the sender and keep the supplied dict as-is
                     self.d = d
-            elif isinstance(d, self.__class__):
-                # We were supplied a fdict, initialize a copy
-                self.d = d.copy().d
+            elif isinstance(d, fdict) and not d.rootpath and d.delimiter == delimiter and d.fastview == fastview and d.nodel == nodel and isinstance(d.d, dict):
+                # We were supplied a fdict with the same layout (and not a nested one), initialize a copy of its internal dict at C speed, without flattening anything
+                dcopy = d.copy()
+                self.d = dcopy.d
+                self._cow = dcopy._cow  # the nodes sets may still be shared with d
             else:
                 # Else it is not an internal call, the user supplied a dict to initialize the fdict, we have to flatten its keys
-                if not isinstance(d, dict):
+                if isinstance(d, fdict):
+                    # A fdict with another layout (eg, a nested fdict, or another mode or out-of-core storage): its items() already yields its flattened leaves relative to its rootpath and without its nodes, so it can be flattened directly like a dict
+                    # Except if the delimiter is different, then its leaves keys must be split into a nested dict first
+                    if d.delimiter != delimiter:
+                        d = d.to_dict_nested()
+                elif not isinstance(d, dict):
                     # User supplied another type of object than dict, we try to convert to a dict and flatten it
                     d = dict(d)
-                self.d = self.flatkeys(d, sep=delimiter)
+                self.d = self._new_internal_dict(d)
                 if fastview:
                     self._build_metadata()
                 elif nodel:
                     self._build_metadata_nodel()
-        else:
+        elif not rootpath:
             # No dict supplied, create an empty dict
+            self.d = self._new_internal_dict()
+        else:
             self.d = dict()
 
         # Call compatibility layer
-        self._viewkeys, self._viewvalues, self._viewitems = self._getitermethods(self.d)
+        if PY3:  # pragma: no cover
+            # Py3: bind directly the internal dict's methods, same as _getitermethods() but without the call and tuple overhead
+            self._viewkeys = self.d.keys
+            self._viewvalues = self.d.values
+            self._viewitems = self.d.items
+        else:
+            self._viewkeys, self._viewvalues, self._viewitems = self._getitermethods(self.d)
+
+    def _new_internal_dict(self, d=None):
+        '''Create the internal dict, filled with the flattened items of the supplied nested dict if any.
+        Subclasses can override this method to use another storage (eg, an out-of-core database).'''
+        if d is None:
+            return dict()
+        return self.flatkeys(d, sep=self.delimiter)
 
     @staticmethod
     def _getitermethods(d):
@@ -152,36 +358,43 @@ class fdict(dict):
 
     @staticmethod
     def _get_all_parent_nodes(path, delimiter='/'):
-        '''Get path to all parent nodes for current leaf, starting from leaf's direct parent down to root'''
-        pos = path.rfind(delimiter)
-        while pos != -1:
-            yield path[:pos+1]
-            pos = path.rfind(delimiter, 0, pos)
+        '''Get path to all parent nodes for current leaf, starting from leaf's direct parent down to root. Returns a list (no generator overhead, callers can index or reverse it).'''
+        parents = []
+        accum = ''
+        # Build all parents with a single split and a cumulative concatenation, from root to the direct parent
+        for part in _split_path(path, delimiter)[:-1]:
+            accum += part + delimiter
+            parents.append(accum)
+        parents.reverse()
+        return parents
 
     @staticmethod
     def _get_all_parent_nodes_nested(path, delimiter='/'):
         '''Get path to all parent nodes for current leaf, starting from root down to leaf's direct parent, and return only the relative key (not the fullkey)'''
+        dlen = len(delimiter)
         pos = path.find(delimiter)
         lastpos = 0
         while pos != -1:
             yield path[lastpos:pos]
-            lastpos = pos+1
-            pos = path.find(delimiter, pos+1)
+            lastpos = pos+dlen
+            pos = path.find(delimiter, lastpos)
 
     @staticmethod
     def _get_parent_node(path, delimiter='/'):
         '''Get path to the first direct parent of current leaf'''
+        dlen = len(delimiter)
         endpos = len(path)  # 'a/b' (leaf)
-        if path[-1:] == delimiter:  # 'a/b/' (node)
-            endpos -= 1
-        return path[:path.rfind(delimiter, 0, endpos)+1]  # note that nodes are returned with the ending delimiter
+        if path[-dlen:] == delimiter:  # 'a/b/' (node)
+            endpos -= dlen
+        pos = path.rfind(delimiter, 0, endpos)
+        return path[:pos+dlen] if pos != -1 else ''  # note that nodes are returned with the ending delimiter
 
     @staticmethod
     def _get_root_parent_node(path, delimiter='/', rootpath=None):
         '''Get path to the root parent of current leaf'''
         if rootpath:
             # Strip out the rootpath
-            startpos = len(rootpath)+1
+            startpos = len(rootpath)+len(delimiter)
         else:
             startpos = 0
 
@@ -189,7 +402,7 @@ class fdict(dict):
         return path[:m] if m >= 0 else None  # note that nodes are returned without the ending delimiter (so that we return both nodes and leaves the same way)
 
     @staticmethod
-    def flatkeys(d, sep="/"):
+    def flatkeys(d, sep="/", prefix=None):
         """
         Flatten a dictionary: build a new dictionary from a given one where all
         non-dict values are left untouched but nested ``dict``s are recursively
@@ -204,27 +417,69 @@ class fdict(dict):
         >>> flatkeys({1: {2: {3: 4}, 5: 6}})
         {'1.2.3': 4, '1.5': 6}
 
+        If a prefix is supplied, all keys are nested under it (this is
+        equivalent to ``flatkeys({prefix: d})`` without building the wrapper dict):
+
+        >>> flatkeys({1: 42, 'bar': {'qux': True}}, prefix='foo')
+        {'foo.1': 42, 'foo.bar.qux': True}
+
         v0.1.0 by bfontaine, MIT license
         """
         flat = {}
-        dicts = [("", d)]
+        dicts = [('%s%s' % (prefix, sep) if prefix is not None else '', d)]
+        # Cache functions lookups for the loop
+        dicts_append = dicts.append
+        type_ = type
+        mapping_types_get = _mapping_types.get
+        str_ = str
 
         while dicts:
             prefix, d = dicts.pop()
             for k, v in d.items():
-                k_s = str(k)
-                if isinstance(v, collections.abc.Mapping):
-                    dicts.append(("%s%s%s" % (prefix, k_s, sep), v))
+                k_s = str_(k)
+                tv = type_(v)
+                is_mapping = mapping_types_get(tv)
+                if is_mapping is None:
+                    is_mapping = _mapping_types[tv] = issubclass(tv, _Mapping)
+                if is_mapping:
+                    dicts_append((prefix + k_s + sep, v))
                 else:
                     k_ = prefix + k_s if prefix else k
                     flat[k_] = v
         return flat
 
+    @staticmethod
+    def _flatkeys_items(d, sep="/"):
+        '''Lazy counterpart of flatkeys(): yield the (flattened key, value) leaves of a nested dict one by one, without materializing the flat dict.
+        Useful when the caller might stop early (eg, __eq__ on the first mismatch).'''
+        dicts = [('', d)]
+        type_ = type
+        mapping_types_get = _mapping_types.get
+        str_ = str
+
+        while dicts:
+            prefix, d = dicts.pop()
+            for k, v in d.items():
+                k_s = str_(k)
+                tv = type_(v)
+                is_mapping = mapping_types_get(tv)
+                if is_mapping is None:
+                    is_mapping = _mapping_types[tv] = issubclass(tv, _Mapping)
+                if is_mapping:
+                    dicts.append((prefix + k_s + sep, v))
+                else:
+                    yield (prefix + k_s if prefix else k), v
+
     def _build_path(self, key=''):
         '''Build full path of current key given the rootpath'''
         # TODO: replace internal keys by mutableobjects instead of strings, it wil make appending much faster!
-        rootpath = self.rootpath
-        return "%s%s%s" % (rootpath, self.delimiter, key) if rootpath else key
+        if not self.rootpath:
+            return key
+        try:
+            return self._rootpath_prefix + key
+        except TypeError:
+            # Non-string key (eg, an int), it is nested anyway so convert it
+            return self._rootpath_prefix + str(key)
 
     def _build_metadata(self, fullkeys=None):
         '''Build metadata to make viewitem and other methods using item resolution faster.
@@ -236,22 +491,78 @@ class fdict(dict):
             fullkeys = list(self._generickeys(self.d))  # need to make a copy else RuntimeError because dict size will change
 
         delimiter = self.delimiter
+        dlen = len(delimiter)
+        # Node keys are interned when first met, so that the same string object is shared by the internal dict's key, the parent node's set and the rootpath prefixes (see _path_prefix()), and the lookups of nodes with these strings are resolved by identity without comparing the characters
+        intern_ = sys.intern
+        # First pass: collect the children of each parent node in a local dict, so that each parent is walked only once, in O(l+m) instead of O(l*m)
+        # Group the leaves by their direct parent node, with a single rfind() per leaf
+        nodes = {}
+        nodes_get = nodes.get
         for fullkey in fullkeys:
-            if not fullkey[-1:] == delimiter:
-                # Create additional entries for each parent at every depths of the current leaf
-                parents = self._get_all_parent_nodes(fullkey, self.delimiter)
-
-                # First parent stores the direct path to the leaf
-                # Then we recursively add the path to the nested parent in all super parents.
-                lastparent = fullkey
-                for parent in parents:
-                    if parent in self.d:
-                        # There is already a parent entry, we add to the set
-                        self.d.__getitem__(parent).add(lastparent)
+            if not fullkey[-dlen:] == delimiter:
+                pos = fullkey.rfind(delimiter)
+                if pos != -1:
+                    parent = fullkey[:pos+dlen]
+                    children = nodes_get(parent)
+                    if children is None:
+                        nodes[intern_(parent)] = set([fullkey])
                     else:
-                        # Else we create a set and add this child
-                        self.d.__setitem__(parent, set([lastparent]))
-                    lastparent = parent
+                        children.add(fullkey)
+        # Then link each of these nodes to its super parents, walking up once per node instead of once per leaf
+        for child in list(nodes):  # copy the keys since super parents are added on the way
+            pos = child.rfind(delimiter, 0, len(child)-dlen)
+            while pos != -1:
+                parent = child[:pos+dlen]
+                children = nodes_get(parent)
+                if children is None:
+                    nodes[intern_(parent)] = children = set()
+                elif child in children:
+                    # This node was already linked by a previous node, so are all its super parents, we can stop here
+                    break
+                children.add(child)
+                child = parent
+                pos = child.rfind(delimiter, 0, len(child)-dlen)
+
+        # Second pass: merge the collected nodes with the internal dict, with one set update per parent node
+        d = self.d
+        d_setitem = d.__setitem__
+        writable = self._cow.writable
+        owned = self._cow.owned
+        for parent, children in nodes.items():
+            if parent in d:
+                # There is already a parent entry, we add to the set (copying it first if it is shared with a copy)
+                writable(d, parent).update(children)
+            else:
+                # Else we store the set of children, which is a new set, so it is not shared with a copy
+                d_setitem(parent, children)
+                if owned is not None:
+                    owned.add(parent)
+
+    def _build_metadata_leaf(self, fullkey):
+        '''Same as _build_metadata([fullkey]) for a single leaf, the case of every __setitem__ in fastview mode, but without grouping the leaves: walk up the parents of the leaf only until a node that already exists (it is already linked to all its super parents).
+        Only for fastview mode.'''
+        d = self.d
+        delimiter = self.delimiter
+        dlen = len(delimiter)
+        child = fullkey
+        pos = child.rfind(delimiter)
+        while pos != -1:
+            parent = child[:pos+dlen]
+            children = d.get(parent)
+            if children is not None:
+                # There is already a parent entry, we add to the set (copying it first if it is shared with a copy) and stop here
+                if child not in children:
+                    self._cow.writable(d, parent).add(child)
+                return
+            # Else we create the node, interned (see _build_metadata()), and continue with its own parent
+            parent = sys.intern(parent)
+            d[parent] = set([child])
+            owned = self._cow.owned
+            if owned is not None:
+                # New set, not shared with a copy
+                owned.add(parent)
+            child = parent
+            pos = child.rfind(delimiter, 0, len(child)-dlen)
 
     def _build_metadata_nodel(self, fullkeys=None):
         '''Build metadata to make contains faster.
@@ -263,17 +574,24 @@ class fdict(dict):
             fullkeys = list(self._generickeys(self.d))  # need to make a copy else RuntimeError because dict size will change
 
         delimiter = self.delimiter
+        dlen = len(delimiter)
+        # Cache the internal dict's methods lookups for the loop
+        d = self.d
+        d_setitem = d.__setitem__
+        intern_ = sys.intern
         for fullkey in fullkeys:
-            if not fullkey[-1:] == delimiter:
-                # Create additional entries for each parent at every depths of the current leaf
-                parents = self._get_all_parent_nodes(fullkey, self.delimiter)
-
-                # First parent stores the direct path to the leaf
-                # Then we recursively add the path to the nested parent in all super parents.
-                for parent in parents:
-                    if not parent in self.d:
-                        # If parent not in dict, we create it
-                        self.d.__setitem__(parent, None)
+            if not fullkey[-dlen:] == delimiter:
+                # Create additional entries for each parent at every depths of the current leaf, walking up from the direct parent
+                pos = fullkey.rfind(delimiter)
+                while pos != -1:
+                    parent = fullkey[:pos+dlen]
+                    if parent in d:
+                        # This node already exists, so do all its super parents (nodes are created with all their super parents, and never deleted in nodel mode), we can stop here
+                        # Thus leaves sharing their parents (eg, from an update()) only cost one lookup each
+                        break
+                    # If parent not in dict, we create it (interned, see _build_metadata())
+                    d_setitem(intern_(parent), None)
+                    pos = fullkey.rfind(delimiter, 0, pos)
 
     def __getitem__(self, key):
         '''Get an item given the key. O(1) in any case: if the item is a leaf, direct access, else if it is a node, a new fdict will be returned with a different rootpath but sharing the same internal dict.'''
@@ -282,13 +600,46 @@ class fdict(dict):
         if fullkey in self.d: # Leaf: return the value (leaf direct access test is why we do `in self.d` and not `in self`)
             return self.d.__getitem__(fullkey)
         else: # Node: return a new full fdict based on the old one but with a different rootpath to limit the results by default (this is the magic that allows compatibility with the syntax d['item1']['item2'])
-            return self.__class__(d=self.d, rootpath=fullkey, delimiter=self.delimiter, fastview=self.fastview, nodel=self.nodel, **self.kwargs)
+            return self._subdict(fullkey)
+
+    def _subdict(self, rootpath):
+        '''Create a nested fdict at the given rootpath sharing the same internal dict, parameters and keys cache as self.
+        This is equivalent to self.__class__(d=self.d, rootpath=rootpath, ...) but skips __init__, since all checks were already done for self. This is the hottest allocation when accessing nested items (eg, d['a']['b']['c']).'''
+        cls = self.__class__
+        sub = cls.__new__(cls)
+        sub.d = self.d
+        sub.rootpath = rootpath
+        sub._rootpath_prefix = _path_prefix(rootpath, self.delimiter) if rootpath else ''
+        sub.delimiter = self.delimiter
+        sub.fastview = self.fastview
+        sub.nodel = self.nodel
+        sub.kwargs = self.kwargs
+        sub._cow = self._cow
+        sub._viewcache = self._viewcache
+        sub._viewkeys = self._viewkeys
+        sub._viewvalues = self._viewvalues
+        sub._viewitems = self._viewitems
+        if cls is not fdict:
+            # Subclasses can store their own attributes (eg, sfdict's filename)
+            self._copy_attributes(sub)
+        return sub
+
+    def _copy_attributes(self, dst, memo=None):
+        '''Copy the attributes of a subclass to dst, a new instance of the same class created without __init__ (see _subdict() and __deepcopy__()). If memo is provided, the attributes are deep copied.
+        By default, copy all the attributes stored in __dict__ at once. Subclasses that store their attributes in their own __slots__ should override this method, and call it for the custom attributes (eg, a monkeypatched method).'''
+        attrs = self.__dict__
+        if attrs:
+            # Only touch dst's __dict__ if there is something to copy, it is allocated on first access
+            if memo is None:
+                dst.__dict__.update(attrs)
+            else:
+                dst.__dict__.update(deepcopy(attrs, memo))
 
     def __setitem__(self, key, value):
-        '''Set an item given the key. Supports for direct setting of nested elements without prior dict(), eg, x['a/b/c'] = 1. O(1) to set the item. If fastview mode, O(m*l) because of metadata building where m is the number of parents of current leaf, and l the number of leaves (if provided a nested dict).'''
-        # TODO: fastview mode can setitem buildmetadata in O(2*(l+m)) linear time instead of O(l*m) quadratic time by first walking nodes and leafs of input dict and finally just merge the nodes sets with self.d, so we walk each parent only once, instead of walking each leaf and then each parent of each leaf repetitively.
+        '''Set an item given the key. Supports for direct setting of nested elements without prior dict(), eg, x['a/b/c'] = 1. O(1) to set the item. If fastview mode, O(m+l) because of metadata building where m is the number of parents of current leaf, and l the number of leaves (if provided a nested dict).'''
         # Build the fullkey
         fullkey = self._build_path(key)
+        self._get_viewcache().clear()  # keys might change
 
         # Store the item
         if isinstance(value, dict):
@@ -309,16 +660,10 @@ class fdict(dict):
                 # User supplied an empty dict, the user wants to create a subdict, but it is not necessary here since nested dict are supported by default, just need to assign nested values
                 return
             else:
-                # else not empty dict, we will merge using update
-                # merge d2 with self.d
-                if isinstance(value, self.__class__):
-                    # If it is the same class as this, we merge
-                    d2 = self.__class__({key: value})
-                    self.update(d2)
-                else:
-                    # If this is just a normal dict, we flatten it and merge
-                    d2 = self.flatkeys({self._build_path(key): value}, sep=self.delimiter)
-                    self.d.update(d2)
+                # else not empty dict, we flatten it and merge d2 with self.d
+                # Note: this also works if value is a fdict, since its items() already yields its flattened leaves, so we do not need to build a temporary fdict and recurse through update()
+                d2 = self.flatkeys(value, sep=self.delimiter, prefix=fullkey)
+                self.d.update(d2)
                 # update metadata
                 if self.fastview:
                     self._build_metadata(self._generickeys(d2))
@@ -335,13 +680,16 @@ class fdict(dict):
                     # If this key was a nested dict before, we need to delete it recursively (with all subelements) and also delete pointer from parent node
                     self.__delitem__(key)
                 # This key did not exist before but a parent is a singleton
-                parents = self._get_all_parent_nodes(fullkey)
-                for parent in parents:
-                    parentleaf = parent[:len(parent)-1]
-                    if parentleaf in self.d:
-                        self.__delitem__(parentleaf)
+                d = self.d
+                delimiter = self.delimiter
+                pos = fullkey.rfind(delimiter)
+                while pos != -1:
+                    parentleaf = fullkey[:pos]
+                    if parentleaf in d:
+                        self.__delitem__(parentleaf, fullpath=True)
+                    pos = fullkey.rfind(delimiter, 0, pos)
                 # Then we can rebuild the metadata to point to this new leaf
-                self._build_metadata([fullkey])
+                self._build_metadata_leaf(fullkey)
             elif self.nodel:
                 # update metadata with nodel mode: just an create empty node to signal its existence
                 self._build_metadata_nodel([fullkey])
@@ -361,43 +709,52 @@ class fdict(dict):
         else:
             fullkey = key
 
-        if fullkey in self.d:
+        self._get_viewcache().clear()  # keys will change
+        # Cache the attributes lookups
+        d = self.d
+        delimiter = self.delimiter
+        if fullkey in d:
             # Key is a leaf, we can directly delete it
             if self.fastview:
                 # Remove current node from its parent node's set()
-                parentnode = self._get_parent_node(fullkey, self.delimiter)
+                parentnode = self._get_parent_node(fullkey, delimiter)
                 if parentnode: # if the node is not 1st-level (because then the parent is the root, it's then a fdict, not a set)
-                    self.d.__getitem__(parentnode).remove(fullkey)
-                    if not self.d.__getitem__(parentnode):
+                    parentset = self._cow.writable(d, parentnode)
+                    parentset.remove(fullkey)
+                    if not parentset:
                         # if the set is now empty, just delete the node (to signal that there is nothing below now)
                         self.__delitem__(parentnode, fullpath=True)  # recursive delete because the node is referenced by its parent
             # Delete the item!
-            return self.d.__delitem__(fullkey)
+            return d.__delitem__(fullkey)
         else:
             # Else there is no direct match, but might be a nested dict, we have to walk through all the dict
-            dirkey = fullkey+self.delimiter
+            dirkey = fullkey+delimiter
             flagdel = False
             if self.fastview:
                 # Fastview mode: use the fast recursive viewkeys(), which will access the supplied node and walk down through all nested elements to build the list of items to delete, without having to walk the whole dict (only the subelements pointed by the current key and the subsubelements of the subkeys etc.)
                 # Note that we ovveride the rootpath of viewkeys, because if delitem is called on a nested element (eg, del x['a']['b']), then the rootpath is the parent, so we will walk through all parent elements when we need only to walk from the child (the current node key), so this is both an optimization and also bugfix (because else we get a different behaviour if we use del x['a/b'] and del x['a']['b'])
                 keystodel = [k for k in self.viewkeys(fullpath=True, nodes=True, rootpath=fullkey)]
                 # We can already delete the current node key
-                self.d.__delitem__(dirkey)
+                d.__delitem__(dirkey)
                 flagdel = True
                 # Remove current node from its parent node's set()
-                parentnode = self._get_parent_node(fullkey, self.delimiter)
+                parentnode = self._get_parent_node(fullkey, delimiter)
                 if parentnode: # if the node is not 1st-level (because then the parent is the root, it's then a fdict, not a set)
-                    self.d.__getitem__(parentnode).remove(dirkey)  # delete current node metadata
-                    if not self.d.__getitem__(parentnode):
+                    parentset = self._cow.writable(d, parentnode)
+                    parentset.remove(dirkey)  # delete current node metadata
+                    if not parentset:
                         # if the set is now empty, just delete the node (to signal that there is nothing below now)
-                        self.__delitem__(parentnode[:len(parentnode)-1], fullpath=True)  # recursive delete because the node is referenced by its parent
+                        self.__delitem__(parentnode[:len(parentnode)-len(delimiter)], fullpath=True)  # recursive delete because the node is referenced by its parent
             else:
                 # Walk through all items in the dict and delete the nodes or nested elements starting from the supplied node (if any)
-                keystodel = [k for k in self._viewkeys() if k.startswith(dirkey)]  # TODO: try to optimize with a generator instead of a list, but with viewkeys the dict is changing at the same time so we get runtime error!
+                # Note: slice equality is faster than startswith() for a fixed prefix because it skips the method call
+                plen = len(dirkey)
+                keystodel = [k for k in self._viewkeys() if k[:plen] == dirkey]  # TODO: try to optimize with a generator instead of a list, but with viewkeys the dict is changing at the same time so we get runtime error!
 
             # Delete all matched keys
+            d_delitem = d.__delitem__
             for k in keystodel:
-                self.d.__delitem__(k)
+                d_delitem(k)
 
             # Check if we deleted at least one key, else raise a KeyError exception
             if not keystodel and not flagdel:
@@ -406,7 +763,7 @@ class fdict(dict):
                 return
 
     def __contains__(self, key):
-        '''Check existence of a key (or subkey) in the dictionary. O(1) for any leaf, O(n) at worst for nested dicts (eg, 'a' in d with d['a/b'] defined) -- except if fastview mode or nodel mode activated'''
+        '''Check existence of a key (or subkey) in the dictionary. O(1) for any leaf, O(1) for nested dicts (eg, 'a' in d with d['a/b'] defined) if fastview mode or nodel mode activated, else O(n) scan of the keys. For in-memory dicts of more than _PathIndex.MINSIZE keys, repeated lookups without any change in between go through the keys index in O(depth) (from the second lookup after a change, see _get_index()), but small dicts, out-of-core dicts and lookups alternating with changes are always scanned in O(n).'''
         fullkey = self._build_path(key)
         if self.d.__contains__(fullkey):
             # Key is a singleton/leaf, there is a direct match
@@ -417,43 +774,102 @@ class fdict(dict):
                 # Fastview mode: nodes are stored so we can directly check in O(1)
                 return self.d.__contains__(dirkey)
             else:
-                # Key might be a node, but we have to check all items
-                for k in self.viewkeys(fullpath=True):
-                    if k.startswith(dirkey):
+                # Key might be a node: lookup the keys index if it pays off (see _get_index()), else walk the internal keys directly with a slice equality, instead of chaining with the rootpath filtering of viewkeys() (the full dirkey already includes the rootpath), and stop at the first match
+                index = self._get_index()
+                if index is not None:
+                    return index.has_node(fullkey)
+                plen = len(dirkey)
+                for k in self._generickeys(self.d):
+                    if k[:plen] == dirkey:
                         return True
                 return False
 
+    def _is_unfiltered(self, nodes, rootpath):
+        '''Check if the view* methods would return all the internal dict's items as-is (no rootpath, and no nodes to filter out)'''
+        return not rootpath and not self.rootpath and (nodes or not (self.fastview or self.nodel))
+
+    def _get_viewcache(self):
+        '''Get the keys cache of the internal dict, emptied first if the internal dict was replaced or changed by another fdict (see _ViewCache.validate())'''
+        cache = self._viewcache
+        cache.validate(self.d)
+        return cache
+
+    def _get_index(self):
+        '''Get the keys index of the internal dict, or None if scanning the keys is cheaper.
+        The index is stored in the keys cache (see _ViewCache), so it is dropped on every change of the keys instead of being updated on every setitem. Since building it costs more than a scan, it is only built for big dicts (see _PathIndex.MINSIZE), and only on the second lookup since the last change: the first one just scans, so that alternating changes and lookups cost no more than scans.
+        Out-of-core dicts (eg, shelve) are never indexed, to not load all their keys in memory.'''
+        d = self.d
+        if not isinstance(d, dict) or len(d) <= _PathIndex.MINSIZE:
+            return None
+        cache = self._get_viewcache()
+        key = (_PathIndex, self.delimiter)
+        index = cache.get(key)
+        if index is None:
+            if _PathIndex not in cache:
+                # First lookup since the last change, just remember it
+                cache[_PathIndex] = True
+                return None
+            index = cache[key] = _PathIndex(self._generickeys(d), self.delimiter)
+        return index
+
+    def _keys_below(self, pattern):
+        '''Get the full keys starting with pattern (ie, below a rootpath), for non-fastview modes.
+        For in-memory dicts, the list is cached until the next change of the keys, so that listing the same nested fdict again is O(m) instead of O(n).'''
+        plen = len(pattern)
+        if not isinstance(self.d, dict):
+            # Out-of-core dict (eg, shelve): do not keep lists of keys in memory, just scan
+            return (k for k in self._viewkeys() if k[:plen] == pattern)
+        cache = self._get_viewcache()
+        keys = cache.get(pattern)
+        if keys is None:
+            index = self._get_index() if not self.nodel else None  # the nodes of nodel mode are not indexed
+            if index is not None:
+                # Walk the subtree in the keys index instead of scanning all the keys
+                keys = index.keys_below(pattern[:plen-len(self.delimiter)])
+            else:
+                keys = [k for k in self._viewkeys() if k[:plen] == pattern]
+            cache.store(pattern, keys)
+        return keys
+
     def viewkeys(self, fullpath=False, nodes=False, rootpath=None):
         '''Show keys of all children of current nodes (at any nested level)'''
+        if self._is_unfiltered(nodes, rootpath):
+            # Nothing to filter: return the internal dict's own iterator, which iterates at C speed and provides an exact __length_hint__ (so that list() can preallocate)
+            return iter(self._viewkeys())
+        return self._viewkeys_filtered(fullpath=fullpath, nodes=nodes, rootpath=rootpath)
+
+    def _viewkeys_filtered(self, fullpath=False, nodes=False, rootpath=None):
         if not rootpath:
             # Allow to override rootpath, particularly useful for delitem (which is always called from parent, so the rootpath is incorrect, overriding the rootpath allows to limit the search breadth)
             rootpath = self.rootpath
 
         delimiter = self.delimiter
+        dlen = len(delimiter)
         if not rootpath:
             # No rootpath, we do not have to do filtering based on rootpath, this simplifies a lot (and speed-up)
-            if self.fastview or self.nodel:
+            if (self.fastview or self.nodel) and not nodes:
                 # Fastview mode or nodel mode: filter out nodes except if nodes=True
                 for k in self._viewkeys():
-                    if nodes or not k[-1:] == delimiter:
+                    if not k[-dlen:] == delimiter:
                         yield k
             else:
-                # Just walk through all keys
+                # No nodes stored or nodes requested: just walk through all keys, without any check per key
                 for k in self._viewkeys():
                     yield k
         else:
             pattern = rootpath+delimiter
             lpattern = len(pattern) if not fullpath else 0 # return the shortened path or fullpath?
+            plen = len(pattern)  # to filter keys with a slice equality k[:plen] == pattern, faster than k.startswith(pattern) since there is no method call
             if self.fastview:
                 # Fastview mode
                 if pattern in self.d:
-                    children = set()
-                    children.update(self.d.__getitem__(pattern).copy())
+                    d_getitem = self.d.__getitem__  # cache the lookup for the loop
+                    children = set(d_getitem(pattern))  # copy the node's set, since we will pop from it
                     while children:
                         child = children.pop()
-                        if child[-1:] == delimiter:
+                        if child[-dlen:] == delimiter:
                             # Node, append all the subchildren to the stack
-                            children.update(self.d.__getitem__(child))
+                            children.update(d_getitem(child))
                             if nodes:
                                 yield child[lpattern:]
                         else:
@@ -461,28 +877,36 @@ class fdict(dict):
                             yield child[lpattern:]
             elif self.nodel:
                 # Nodel mode: take care of nodes (ending with the delimiter) depending on nodes=False or True
-                plen = len(pattern)  # if nodes, need to check if the current node is not the rootpath!
-                for k in (k[lpattern:] for k in self._viewkeys() if k.startswith(pattern) and ((nodes and len(k) != plen) or not k[-1:] == delimiter)):
-                    yield k
+                # if nodes, need to check if the current node is not the rootpath (ie, len(k) != plen)!
+                for k in self._keys_below(pattern):
+                    if (nodes and len(k) != plen) or not k[-dlen:] == delimiter:
+                        yield k[lpattern:]
             else:
-                for k in (k[lpattern:] for k in self._viewkeys() if k.startswith(pattern)):
-                    yield k
+                for k in self._keys_below(pattern):
+                    yield k[lpattern:]
 
     def viewitems(self, fullpath=False, nodes=False, rootpath=None):
+        if self._is_unfiltered(nodes, rootpath):
+            # Nothing to filter: return the internal dict's own iterator, see viewkeys()
+            return iter(self._viewitems())
+        return self._viewitems_filtered(fullpath=fullpath, nodes=nodes, rootpath=rootpath)
+
+    def _viewitems_filtered(self, fullpath=False, nodes=False, rootpath=None):
         if not rootpath:
             # Allow to override rootpath, particularly useful for delitem (which is always called from parent, so the rootpath is incorrect, overriding the rootpath allows to limit the search breadth)
             rootpath = self.rootpath
 
         delimiter = self.delimiter
+        dlen = len(delimiter)
         if not rootpath:
             # Return all items (because no rootpath, so no filter)
-            if self.fastview or self.nodel:
+            if (self.fastview or self.nodel) and not nodes:
                 # Fastview mode, filter out nodes (ie, keys ending with delimiter) to keep only leaves
                 for k,v in self._viewitems():
-                    if not k[-1:] == delimiter or nodes:
+                    if not k[-dlen:] == delimiter:
                         yield k,v
             else:
-                # No fastview, just return the internal dict's items
+                # No fastview or nodes requested, just return the internal dict's items
                 for k,v in self._viewitems():
                     yield k,v
         else:
@@ -490,41 +914,52 @@ class fdict(dict):
             # Prepare the pattern (the rootpath + delimiter) to filter items keys
             pattern = rootpath+self.delimiter
             lpattern = len(pattern) if not fullpath else 0 # return the shortened path or fullpath?
+            plen = len(pattern)  # to filter keys with a slice equality k[:plen] == pattern, faster than k.startswith(pattern) since there is no method call
             if self.fastview:
                 # Fastview mode, get the list of items directly from the current entry, and walk recursively all children to get down to the leaves
                 if pattern in self.d:
-                    children = set()
-                    children.update(self.d.__getitem__(pattern))
+                    d_getitem = self.d.__getitem__  # cache the lookup for the loop
+                    children = set(d_getitem(pattern))
                     while children:
                         child = children.pop()
-                        if child[-1:] == delimiter:
+                        if child[-dlen:] == delimiter:
                             # Node, append all the subchildren to the stack
-                            children.update(self.d.__getitem__(child))
+                            children.update(d_getitem(child))
                             if nodes:
-                                yield child[lpattern:], set([c[lpattern:] for c in self.d.__getitem__(child)])
+                                yield child[lpattern:], set([c[lpattern:] for c in d_getitem(child)])
                         else:
                             # Leaf, return the key and value
-                            yield child[lpattern:], self.d.__getitem__(child)
+                            yield child[lpattern:], d_getitem(child)
             elif self.nodel:
                 # Nodel mode: take care of nodes (ending with the delimiter) depending on nodes=False or True
-                plen = len(pattern)  # if nodes, need to check if the current node is not the rootpath!
-                for k in ((k[lpattern:], v) for k,v in self._viewitems() if k.startswith(pattern) and ((nodes and len(k) != plen) or not k[-1:] == delimiter)):
-                    yield k
+                # if nodes, need to check if the current node is not the rootpath (ie, len(k) != plen)!
+                d_getitem = self.d.__getitem__
+                for k in self._keys_below(pattern):
+                    if (nodes and len(k) != plen) or not k[-dlen:] == delimiter:
+                        yield k[lpattern:], d_getitem(k)
             else:
-                # No fastview, just walk through all items and filter out the ones that are not in the current rootpath
-                for k,v in ((k[lpattern:], v) for k,v in self._viewitems() if k.startswith(pattern)):
-                    yield k,v
+                # No fastview, just get the keys that are in the current rootpath
+                d_getitem = self.d.__getitem__
+                for k in self._keys_below(pattern):
+                    yield k[lpattern:], d_getitem(k)
 
     def viewvalues(self, fullpath=False, nodes=False, rootpath=None):
+        if self._is_unfiltered(nodes, rootpath):
+            # Nothing to filter: return the internal dict's own iterator, see viewkeys()
+            return iter(self._viewvalues())
+        return self._viewvalues_filtered(fullpath=fullpath, nodes=nodes, rootpath=rootpath)
+
+    def _viewvalues_filtered(self, fullpath=False, nodes=False, rootpath=None):
         if not rootpath:
             # Allow to override rootpath, particularly useful for delitem (which is always called from parent, so the rootpath is incorrect, overriding the rootpath allows to limit the search breadth)
             rootpath = self.rootpath
 
         delimiter = self.delimiter
+        dlen = len(delimiter)
         if not rootpath:
-            if self.fastview or self.nodel:
+            if (self.fastview or self.nodel) and not nodes:
                 for k,v in self._viewitems():
-                    if not k[-1:] == delimiter or nodes:
+                    if not k[-dlen:] == delimiter:
                         yield v
             else:
                 for v in self._viewvalues():
@@ -532,29 +967,32 @@ class fdict(dict):
         else:
             pattern = rootpath+self.delimiter
             lpattern = len(pattern) if not fullpath else 0 # return the shortened path or fullpath? useful only if nodes=True
+            plen = len(pattern)  # to filter keys with a slice equality k[:plen] == pattern, faster than k.startswith(pattern) since there is no method call
             if self.fastview:
                 # Fastview mode
                 if pattern in self.d:
-                    children = set()
-                    children.update(self.d.__getitem__(pattern))
+                    d_getitem = self.d.__getitem__  # cache the lookup for the loop
+                    children = set(d_getitem(pattern))
                     while children:
                         child = children.pop()
-                        if child[-1:] == delimiter:
+                        if child[-dlen:] == delimiter:
                             # Node, append all the subchildren to the stack
-                            children.update(self.d.__getitem__(child))
+                            children.update(d_getitem(child))
                             if nodes:
-                                yield set([c[lpattern:] for c in self.d.__getitem__(child)])
+                                yield set([c[lpattern:] for c in d_getitem(child)])
                         else:
                             # Leaf, return the key and value
-                            yield self.d.__getitem__(child)
+                            yield d_getitem(child)
             elif self.nodel:
                 # Nodel mode: take care of nodes (ending with the delimiter) depending on nodes=False or True
-                plen = len(pattern)
-                for v in (v for k,v in self._viewitems() if k.startswith(pattern) and ((nodes and len(k) != plen) or not k[-1:] == delimiter)):
-                    yield v
+                d_getitem = self.d.__getitem__
+                for k in self._keys_below(pattern):
+                    if (nodes and len(k) != plen) or not k[-dlen:] == delimiter:
+                        yield d_getitem(k)
             else:
-                for v in (v for k,v in self._viewitems() if k.startswith(pattern)):
-                    yield v
+                d_getitem = self.d.__getitem__
+                for k in self._keys_below(pattern):
+                    yield d_getitem(k)
 
     iterkeys = viewkeys
     itervalues = viewvalues
@@ -637,8 +1075,9 @@ class fdict(dict):
     def update(self, d2):
         if isinstance(d2, self.__class__):
             # Same class, we walk d2 but we cut d2 rootpath (fullpath=False) since we will rebase on our own self.d dict
-            d2items = d2.viewitems(fullpath=False, nodes=False)  # ensure we do not add nodes, we need to rebuild anyway
-            d2keys = d2.viewkeys(fullpath=False, nodes=False)  # duplicate for reuse
+            # Walk d2 only once (its internal dict may be expensive to iterate, eg, a shelve), and keep the items in a list so they can be reused for keys
+            d2items = list(d2.viewitems(fullpath=False, nodes=False))  # ensure we do not add nodes, we need to rebuild anyway
+            d2keys = [k for k, _ in d2items]
         elif isinstance(d2, dict):
             # normal dict supplied
             d2 = self.flatkeys(d2, sep=self.delimiter) # first, flatten the dict keys
@@ -648,40 +1087,95 @@ class fdict(dict):
             raise ValueError('Supplied argument is not a dict.')
 
         # Update our dict with d2 leaves
+        self._get_viewcache().clear()  # keys will change
         if self.rootpath:
             # There is a rootpath, so user is selecting a sub dict (eg, d['item1']), so we need to reconstruct d2 with the full key path rebased on self.d before merging
-            rtncode = self.d.update((self._build_path(k), v) for k,v in d2items)
+            # The prefix is fixed for the whole call, so concatenate it inline instead of calling _build_path() per key, and materialize the full keys only once since they are reused below for the metadata
+            prefix = self._rootpath_prefix
+            try:
+                fullkeys = [prefix + k for k in d2keys]
+            except TypeError:
+                # Non-string key (eg, an int), fallback to the slower but safe path building
+                fullkeys = [self._build_path(k) for k in d2keys]
+            # keys and items are walked in the same order (same dict or same list), so we can zip them back together
+            rtncode = self.d.update(_zip(fullkeys, (v for _, v in d2items)))
         else:
             # No rootpath, we can update directly because both dicts are comparable
-            if isinstance(d2, self.__class__):
-                rtncode = self.d.update(d2items)
-            else:
-                rtncode = self.d.update(d2items)
+            rtncode = self.d.update(d2items)
+            fullkeys = d2keys
 
         # Fastview mode: we have to take care of nodes, since they are set(), they will get replaced and we might lose some pointers as they will all be replaced by d2's pointers, so we have to merge them separately
         # The only solution is to skip d2 nodes altogether and rebuild the metadata for each new leaf added. This is faster than trying to merge separately each d2 set with self.d, because anyway we also have to rebuild for d2 root nodes (which might not be self.d root nodes particularly if rootpath is set)
         if self.fastview:
-            self._build_metadata(self._build_path(k) for k in d2keys)
+            self._build_metadata(fullkeys)
         elif self.nodel:
-            self._build_metadata_nodel(self._build_path(k) for k in d2keys)
+            self._build_metadata_nodel(fullkeys)
 
         return rtncode
 
     def copy(self):
-        fcopy = self.__class__(d=self.d.copy(), rootpath=self.rootpath, delimiter=self.delimiter, fastview=self.fastview, nodel=self.nodel, **self.kwargs)
+        '''Shallow copy: the internal dict is copied at C speed and the parameters are copied over, without going through __init__, since the keys are already flattened and the metadata already built'''
+        d = self.d.copy()
+        cls = self.__class__
+        fcopy = cls.__new__(cls)
+        fcopy.d = d
+        fcopy.rootpath = self.rootpath
+        fcopy._rootpath_prefix = self._rootpath_prefix
+        fcopy.delimiter = self.delimiter
+        fcopy.fastview = self.fastview
+        fcopy.nodel = self.nodel
+        fcopy.kwargs = self.kwargs.copy()
+        fcopy._cow = _NodeSetsCopyOnWrite()
+        fcopy._viewcache = _ViewCache()
+        fcopy._viewkeys, fcopy._viewvalues, fcopy._viewitems = self._getitermethods(d)
+        if cls is not fdict:
+            self._copy_attributes(fcopy)
         if self.fastview:
-            # Fastview mode: we need to ensure we have copies of every sets used for nodes, else the nodes will reference (delitem included) the same items in both the original and the copied fdict!
-            for k in fcopy._viewkeys():
-                if k.endswith(fcopy.delimiter):
-                    fcopy.d[k] = fcopy.d[k].copy()
+            # Fastview mode: the sets used for nodes are now referenced by both the original and the copied fdict, so they must not be modified in place anymore (delitem included) else the changes would show in both!
+            # Instead of copying all the sets now, they are copied lazily on their first mutation (copy-on-write), so that unmodified nodes cost nothing
+            self._cow.share()
+            fcopy._cow.share()
         return fcopy
 
+    def __deepcopy__(self, memo):
+        '''Deep copy, by pickling the internal dict when possible, which is several times faster than deepcopy() for dicts of primitive values and sets (such as fastview nodes)'''
+        d = None
+        if not memo:
+            # Top-level deepcopy: pickling keeps the sharing between the values of the internal dict, but not with the objects outside of it, so this is only safe when there is nothing outside, ie, when the memo is empty (eg, not for deepcopy([a, l]) where l is also a value of a)
+            try:
+                d = pickle.loads(pickle.dumps(self.d, PICKLE_HIGHEST_PROTOCOL))
+            except Exception:
+                # Some values cannot be pickled (eg, lambdas), or the internal dict is out-of-core
+                pass
+        if d is None:
+            d = deepcopy(self.d, memo)
+        cls = self.__class__
+        dcopy = cls.__new__(cls)
+        memo[id(self)] = dcopy
+        dcopy.d = d
+        dcopy.rootpath = self.rootpath
+        dcopy._rootpath_prefix = self._rootpath_prefix
+        dcopy.delimiter = self.delimiter
+        dcopy.fastview = self.fastview
+        dcopy.nodel = self.nodel
+        dcopy.kwargs = deepcopy(self.kwargs, memo)
+        dcopy._cow = _NodeSetsCopyOnWrite()
+        dcopy._viewcache = _ViewCache()
+        dcopy._viewkeys, dcopy._viewvalues, dcopy._viewitems = self._getitermethods(d)
+        if cls is not fdict:
+            self._copy_attributes(dcopy, memo)
+        return dcopy
+
     @staticmethod
     def _count_iter_items(iterable):
         '''
         Consume an iterable not reading it into memory; return the number of items.
         by zuo: https://stackoverflow.com/a/15112059/1121352
         '''
+        if hasattr(iterable, '__len__'):
+            # Sized collection (eg, a list or a dict view): the size is known without iterating
+            # Note: we do not use operator.length_hint() for iterators, since it is only an estimate
+            return len(iterable)
         counter = itertools.count()
         collections.deque(_zip(iterable, counter), maxlen=0)  # (consume at C speed)
         return next(counter)
@@ -689,12 +1183,34 @@ class fdict(dict):
     def __len__(self):
         if not self.rootpath and (not self.fastview and not self.nodel):
             return self.d.__len__()
+        elif self.rootpath and self.fastview:
+            # Fastview mode: count the leaves by walking down the nodes sets of the current subtree only, without building nor yielding the shortened keys as viewkeys() would do
+            d = self.d
+            delimiter = self.delimiter
+            dlen = len(delimiter)
+            pattern = self._rootpath_prefix
+            if pattern not in d:
+                return 0
+            count = 0
+            children = list(d[pattern])
+            children_pop = children.pop
+            children_extend = children.extend
+            while children:
+                child = children_pop()
+                if child[-dlen:] == delimiter:
+                    children_extend(d[child])
+                else:
+                    count += 1
+            return count
         else:
             # If there is a rootpath, we have to limit the length to the subelements
             return self._count_iter_items(self.viewkeys())
 
     def __eq__(self, d2):
         # Note that if using fastmode and you want to compare an extract(), you cannot compare the nodes unless you fdict(d2)!
+        if type(d2) is type(self) and not self.rootpath and self.fastview == d2.fastview and self.nodel == d2.nodel:
+            # Fast path for the most common case: same class and same config, we can directly compare the internal dicts (exact type check, faster than isinstance() since there is no MRO walk)
+            return self._eq_internal_dicts(self.d, d2.d)
         is_fdict = isinstance(d2, self.__class__)
         is_dict = isinstance(d2, dict)
         if not is_dict and not is_fdict:
@@ -703,37 +1219,88 @@ class fdict(dict):
         else:
             if is_fdict and not self.rootpath and self.fastview == d2.fastview and self.nodel == d2.nodel:
                 # fdict, we can directly compare the internal dicts (but only if fastview is the same for both)
-                return (self.d == d2.d)
+                return self._eq_internal_dicts(self.d, d2.d)
             else:
                 kwargs = {}
                 if is_fdict:
-                    if len(self) != len(d2) and self.fastview == d2.fastview and self.nodel == d2.nodel:
+                    if self.d is d2.d and self.rootpath == d2.rootpath and self.fastview == d2.fastview and self.nodel == d2.nodel:
+                        # Same view of the same internal dict (eg, a['b'] == a['b'])
+                        return True
+                    if len(self) != len(d2):
                         # If size is different then the dicts are different
+                        # Note that len() counts only the leaves whatever the fastview and nodel modes, so this also works between different modes
                         # Note that we need to compare the items because we need to filter if we are looking at nested keys (ie, if there is a rootpath)
                         return False
                     else:
                         kwargs['fullpath'] = False
-                else:  # normal dict, need to flatten it first
-                    d2 = self.__class__.flatkeys(d2, sep=self.delimiter)
-                    if len(self) != len(d2):
-                        return False
+                else:
+                    # Normal dict: walk its flattened leaves lazily and compare them as we go, so that we can bail out on the first mismatch without ever building the whole flattened dict
+                    # Cache the lookups for the loop, and hoist the rootpath prefix to build the full keys inline
+                    d_get = self.d.get
+                    prefix = self._rootpath_prefix
+                    matched = set()  # distinct full keys, since a dict can flatten to the same key twice (eg, {'a/b': 1, 'a': {'b': 1}})
+                    for k, v in self._flatkeys_items(d2, sep=self.delimiter):
+                        try:
+                            fullkey = prefix + k
+                        except TypeError:
+                            # Non-string key (eg, an int)
+                            fullkey = self._build_path(k)
+                        # Single lookup, the sentinel tells us if the key is missing
+                        got = d_get(fullkey, _MISSING)
+                        if got is _MISSING or got != v:
+                            return False
+                        matched.add(fullkey)
+                    # All d2 leaves are in self, the dicts are equal only if self has no other leaf
+                    return len(matched) == len(self)
 
                 # Else size is the same, check each item if they are equal
                 # BTW, we use viewitems to filter according to rootpath the items we compare (else we will compare the full dict to d2 if d2 is a fdict, which is probably not what the user wants if he does d['item1'] == d2)
                 d2items = self._genericitems(d2, **kwargs)
+                # Cache the lookups for the loop, and hoist the rootpath prefix to build the full keys inline
+                d_get = self.d.get
+                prefix = self._rootpath_prefix
                 for k, v in d2items:
-                    fullkey = self._build_path(k)
-                    if not fullkey in self.d or self.d.__getitem__(fullkey) != v:
+                    try:
+                        fullkey = prefix + k
+                    except TypeError:
+                        # Non-string key (eg, an int)
+                        fullkey = self._build_path(k)
+                    # Single lookup, the sentinel tells us if the key is missing
+                    got = d_get(fullkey, _MISSING)
+                    if got is _MISSING or got != v:
                         return False
                 return True
 
+    @staticmethod
+    def _eq_internal_dicts(d, d2):
+        '''Compare two internal dicts, without materializing the out-of-core ones'''
+        if d is d2:
+            return True
+        elif type(d) is dict and type(d2) is dict:
+            # C-level dict comparison
+            return d == d2
+        # Out-of-core dicts (eg, shelves): Mapping.__eq__() would build a temporary in-memory dict of each, compare item by item instead
+        if len(d) != len(d2):
+            return False
+        d2_get = d2.get
+        for k, v in d.items():
+            got = d2_get(k, _MISSING)
+            if got is _MISSING or got != v:
+                return False
+        return True
+
     def __ne__(self, d2):
         return not self == d2  # do not use self.__eq__(d2), for more infos see https://stackoverflow.com/questions/4352244/python-should-i-implement-ne-operator-based-on-eq/30676267#30676267
 
+    @staticmethod
+    def _repr_items(items):
+        '''Build the same representation as repr(dict(items)), but streamed from the items without building a temporary dict'''
+        return '{' + ', '.join(['%r: %r' % (k, v) for k, v in items]) + '}'
+
     def __repr__(self, nodes=True):
         # Filter the items if there is a rootpath and return as a new fdict
         if self.rootpath:
-            return repr(dict(self.items(fullpath=False, nodes=nodes)))
+            return self._repr_items(self.items(fullpath=False, nodes=nodes))
         else:
             try:
                 return self.d.__repr__()
@@ -742,7 +1309,8 @@ class fdict(dict):
 
     def __str__(self, nodes=False):
         if self.rootpath:
-            return str(dict(self.items(fullpath=False, nodes=nodes)))
+            # str() of a dict is the repr() of its items
+            return self._repr_items(self.items(fullpath=False, nodes=nodes))
         else:
             try:
                 return self.d.__str__()
@@ -752,17 +1320,33 @@ class fdict(dict):
     def pop(self, k, d=None, fullpath=True):
         # TODO: allow to return only direct children, and not leaves at any nested level. Could use _get_first_parent_node() and discriminate with previously returned parent to avoid duplicates? Then if leaf we do a self.d.pop(), else if node we do a self.__getitem__().extract() and then a self.__delitem__(). Meanwhile there is first_item() method.
         fullkey = self._build_path(k)
-        if fullkey in self.d:
-            # Leaf
-            if not self.fastview:
-                res = self.d.pop(fullkey)
-            else:
-                res = self.d.__getitem__(fullkey)
-                self.__delitem__(fullkey, fullpath=True)  # need to rebuild the metadata
+        self._get_viewcache().clear()  # keys might change
+        # Leaf: get the value with a single lookup, the sentinel tells us if the key is missing (then it might be a node)
+        if not self.fastview:
+            res = self.d.pop(fullkey, _MISSING)
         else:
+            res = self.d.get(fullkey, _MISSING)
+            if res is not _MISSING:
+                self.__delitem__(fullkey, fullpath=True)  # need to rebuild the metadata
+        if res is _MISSING:
             # Node
             if self.fastview and fullkey+self.delimiter not in self.d:
                 res = None
+            elif not self.fastview and not self.nodel:
+                # Default mode: move the leaves out of the internal dict in a single pass over the keys below the node (see _keys_below(), which may use the keys index), instead of extracting them and then scanning all the keys to delete them
+                pattern = fullkey+self.delimiter
+                keys = list(self._keys_below(pattern))  # copy, since the keys are deleted below
+                self._get_viewcache().clear()  # _keys_below() cached the keys we are deleting
+                if not keys:
+                    return d
+                d_pop = self.d.pop
+                popped = [(key, d_pop(key)) for key in keys]
+                # Same result as extract()
+                if fullpath:
+                    return self.__class__(d=popped, rootpath=fullkey, delimiter=self.delimiter, fastview=self.fastview, nodel=self.nodel, **self.kwargs)
+                else:
+                    plen = len(pattern)
+                    return self.__class__(d=dict((key[plen:], v) for key, v in popped), rootpath='', delimiter=self.delimiter, fastview=self.fastview, nodel=self.nodel)
             else:
                 # We can check with fastview if the node exists beforehand
                 res = self.__getitem__(k).extract(fullpath=fullpath)
@@ -775,8 +1359,34 @@ class fdict(dict):
             return d
 
     def popitem(self):
+        self._get_viewcache().clear()  # keys will change
         if not self.fastview:
             return self.d.popitem()
+        elif not self.rootpath:
+            # Fastview mode without rootpath: use the internal dict popitem(), which is O(1), instead of scanning for the first leaf with viewitems()
+            # Nodes popped on the way are set aside and put back afterwards (putting them back immediately would just pop them again since popitem() is LIFO)
+            d = self.d
+            delimiter = self.delimiter
+            dlen = len(delimiter)
+            nodes = []
+            try:
+                while True:
+                    k, v = d.popitem()
+                    if k[-dlen:] != delimiter:
+                        break
+                    nodes.append((k, v))
+            except KeyError:
+                raise KeyError('popitem(): dictionary is empty')
+            finally:
+                if nodes:
+                    d.update(nodes)
+            # Update the metadata for this leaf only: remove it from its parent node's set(), and delete the parent node if now empty
+            parentnode = self._get_parent_node(k, delimiter)
+            if parentnode:
+                self._cow.writable(d, parentnode).remove(k)
+                if not d.__getitem__(parentnode):
+                    self.__delitem__(parentnode, fullpath=True)
+            return k, v
         else:
             try:
                 k, v = next(self.viewitems(fullpath=False, nodes=False))
@@ -787,6 +1397,9 @@ class fdict(dict):
 
     def to_dict(self):
         '''Convert to a flattened dict'''
+        if not self.rootpath and not self.fastview and not self.nodel:
+            # Nothing to filter (no rootpath nor nodes), the internal dict can be copied as-is at C speed
+            return dict(self.d)
         return dict(self.items())
 
     def extract(self, fullpath=True):
@@ -808,28 +1421,177 @@ class fdict(dict):
         delimiter = self.delimiter
         # Constuct the nested dict for each leaf
         for k, v in self.viewitems(nodes=False):
-            # Get all parents of the current leaf, from root down to the leaf's direct parent
-            parents = self._get_all_parent_nodes_nested(k, delimiter)
+            # Split the key only once to get both all parents of the current leaf (from root down to the leaf's direct parent) and the leaf key
+            parents = k.split(delimiter)
+            k = parents.pop()
             # Recursively create each node of this subdict branch
             d2sub = d2
             for parent in parents:
-                if not parent in d2sub:
-                    # Create the node if it does not exist
-                    d2sub[parent] = {}
-                # Continue from this node
-                d2sub = d2sub[parent]
-            # get leaf key
-            k = k[k.rfind(delimiter)+1:]
+                # Continue from this node, creating it if it does not exist (setdefault() does both with one hash lookup)
+                d2sub = d2sub.setdefault(parent, {})
             # set leaf value
             d2sub[k] = v
         return d2
 
 
+class _Shelf(shelve.Shelf):
+    '''
+    Shelf (de)serializing the values with pickle.dumps() and pickle.loads() directly, instead of going through a BytesIO buffer and a Pickler/Unpickler object per access as shelve.Shelf does.
+    This avoids one copy of the pickled bytes per access (BytesIO.getvalue()) and the objects creation overhead, which matters for large leaves.
+    Subclasses can override _dumps() and _loads() to change the serialization of values.
+    If primitive is True, int, float and str values are stored with a compact text encoding instead of pickle, without pickle's framing and opcodes overhead, which is most of the size of small values.
+    If serializer is 'msgpack', values are serialized with msgpack when it supports them exactly (ie, without turning tuples into lists), which is faster to encode and more compact than pickle for small values. Other values are still pickled.
+    '''
+    _MSGPACK_EXT_SET = 1  # msgpack extension type code for sets
+
+    def __init__(self, dict, protocol=None, writeback=False, keyencoding='utf-8', primitive=False, serializer='pickle'):
+        shelve.Shelf.__init__(self, dict, protocol=protocol, writeback=writeback, keyencoding=keyencoding)
+        self._primitive = primitive  # do not store bound methods here, the reference cycle would delay the shelf's __del__ (which syncs) after its database is closed
+        self._packer = self._get_packer(serializer)  # reused for all values, creating a msgpack.Packer per value is slower than pickle
+
+    @staticmethod
+    def _get_packer(serializer):
+        '''Get the msgpack packer given the serializer name ('pickle' or 'msgpack'), or None for pickle'''
+        if serializer == 'pickle':
+            return None
+        elif serializer == 'msgpack':
+            # Optional dependency: pip install msgpack
+            import msgpack
+            # strict_types so that tuples and subclasses (eg, namedtuples) are not silently converted, they will be pickled instead
+            return msgpack.Packer(use_bin_type=True, strict_types=True, default=_Shelf._msgpack_default)
+        else:
+            raise ValueError('Unknown serializer: %s' % serializer)
+
+    @staticmethod
+    def _msgpack_default(obj):
+        '''Encode the types msgpack does not support natively, or raise a TypeError to fall back to pickle'''
+        if obj.__class__ is set:
+            import msgpack
+            return msgpack.ExtType(_Shelf._MSGPACK_EXT_SET, msgpack.packb(list(obj), use_bin_type=True, strict_types=True, default=_Shelf._msgpack_default))
+        raise TypeError('Cannot serialize %s with msgpack' % type(obj))
+
+    @staticmethod
+    def _msgpack_loads(data):
+        import msgpack
+        # strict_map_key=False to allow dicts with non-str keys (eg, int), which msgpack refuses by default
+        return msgpack.unpackb(data, raw=False, strict_map_key=False, ext_hook=_Shelf._msgpack_ext_hook)
+
+    @staticmethod
+    def _msgpack_ext_hook(code, data):
+        if code == _Shelf._MSGPACK_EXT_SET:
+            return set(_Shelf._msgpack_loads(data))
+        import msgpack
+        return msgpack.ExtType(code, data)
+
+    def _dumps(self, value):
+        if self._primitive:
+            return self._dumps_primitive(value)
+        return self._dumps_object(value)
+
+    def _loads(self, data):
+        if self._primitive:
+            return self._loads_primitive(data)
+        return self._loads_object(data)
+
+    def _dumps_object(self, value):
+        if self._packer is not None:
+            # msgpack data is tagged to distinguish it from pickles (which always start with the PROTO opcode b'\x80', but so does an empty map in msgpack) and from primitive values
+            try:
+                return b'm' + self._packer.pack(value)
+            except (TypeError, ValueError, OverflowError):
+                # Type not supported by msgpack (eg, tuple) or out of range (eg, int over 64 bits), fall back to pickle
+                pass
+        return pickle.dumps(value, self._protocol)
+
+    def _loads_object(self, data):
+        if self._packer is not None and data[:1] == b'm':
+            return self._msgpack_loads(data[1:])
+        return pickle.loads(data)
+
+    def _dumps_primitive(self, value):
+        # Encode primitive values as a type tag followed by their text representation
+        # There is no ambiguity with pickled values, since pickles (protocol >= 2) always start with the PROTO opcode b'\x80'
+        # Note: exact types are checked on purpose, to exclude subclasses (eg, bool, which must be restored as a bool)
+        cls = value.__class__
+        if cls is int:
+            try:
+                return b'i' + str(value).encode('ascii')
+            except (ValueError, OverflowError):
+                # Too many digits for str() (see sys.set_int_max_str_digits()), pickle it instead
+                pass
+        elif cls is float:
+            return b'f' + repr(value).encode('ascii')
+        elif cls is str:
+            try:
+                return b's' + value.encode('utf-8')
+            except UnicodeError:
+                pass
+        return self._dumps_object(value)
+
+    def _loads_primitive(self, data):
+        tag = data[:1]
+        if tag == b'i':
+            return int(data[1:])
+        elif tag == b'f':
+            return float(data[1:])
+        elif tag == b's':
+            return data[1:].decode('utf-8')
+        else:
+            return self._loads_object(data)
+
+    def __getitem__(self, key):
+        try:
+            value = self.cache[key]
+        except KeyError:
+            value = self._loads(self.dict[key.encode(self.keyencoding)])
+            if self.writeback:
+                self.cache[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        # Serialize first, so that a value that cannot be serialized is not left in the writeback cache (else every later sync() would fail on it)
+        data = self._dumps(value)
+        if self.writeback:
+            self.cache[key] = value
+        self.dict[key.encode(self.keyencoding)] = data
+
+
+class _CompressedShelf(_Shelf):
+    '''
+    Shelf compressing the pickled values before storing them in the database, to reduce the I/O volume (and the file size) of out-of-core dicts.
+    Keys are left untouched.
+    '''
+    def __init__(self, dict, protocol=None, writeback=False, keyencoding='utf-8', primitive=False, serializer='pickle', compress='zlib'):
+        _Shelf.__init__(self, dict, protocol=protocol, writeback=writeback, keyencoding=keyencoding, primitive=primitive, serializer=serializer)
+        self._compress, self._decompress = self._get_codec(compress)
+
+    @staticmethod
+    def _get_codec(compress):
+        '''Get the compression and decompression functions given the algorithm name ('zlib' or 'zstd', True means 'zlib')'''
+        if compress is True or compress == 'zlib':
+            return zlib.compress, zlib.decompress
+        elif compress == 'zstd':
+            # Optional dependency: pip install zstandard
+            import zstandard
+            return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+        else:
+            raise ValueError('Unknown compression algorithm: %s' % compress)
+
+    def _dumps(self, value):
+        return self._compress(_Shelf._dumps(self, value))
+
+    def _loads(self, data):
+        return _Shelf._loads(self, self._decompress(data))
+
+
 class sfdict(fdict):
     '''
     A nested dict with flattened internal representation, combined with shelve to allow for efficient storage and memory allocation of huge nested dictionnaries.
     If you change leaf items (eg, list.append), do not forget to sync() to commit changes to disk and empty memory cache because else this class has no way to know if leaf items were changed!
     '''
+    # Store the settings in slots too, like fdict's parameters, since they are copied to the new sfdict created at each access of a node (see _copy_attributes())
+    __slots__ = ('filename', 'autosync', 'syncinterval', '_lastsync', 'writeback', 'forcedumbdbm', 'compress', 'primitive', 'serializer', 'readonly', 'usedumbdbm')
+
     def __init__(self, *args, **kwargs):
         '''
         Parameters
@@ -845,7 +1607,7 @@ class sfdict(fdict):
             [default : '/']
         fastview  : bool, optional
             Activates fastview mode, which makes setitem slower
-            in O(m*l) instead of O(1), but makes view* methods
+            in O(m+l) instead of O(1), but makes view* methods
             (viewitem, viewkeys, viewvalues) as fast as dict's.
             [default : False]
         nodel  : bool, optional
@@ -868,8 +1630,16 @@ class sfdict(fdict):
             (because there is no way to know if a leaf collection changed).
             Drawback: if you do a lot of assignments, this will significantly
             slow down your processing, so it is advised to rather sync()
-            manually at regular intervals.
+            manually at regular intervals, or to assign many items at once
+            with update(), which syncs only once.
             [default : False]
+        syncinterval : float, optional
+            With autosync, commit at most once every syncinterval
+            seconds instead of at every assignment: an assignment
+            only syncs if the last sync is older than that. Pending
+            changes are still committed by sync() and close().
+            0 syncs at every assignment.
+            [default : 0]
         writeback : bool, optional
             Activates shelve writeback option. If False, only assignments
             will allow committing changes of leaf collections. See shelve
@@ -886,6 +1656,27 @@ class sfdict(fdict):
         readonly : bool, optional
             Open the database as read-only.
             [default : False]
+        compress : bool or str, optional
+            Compress the values stored in the database, to reduce
+            the I/O volume and the file size at the expense of CPU time.
+            Can be 'zlib' (or True) or 'zstd' (faster, but requires the
+            zstandard module). A database must always be reopened with
+            the same compress value as when it was created.
+            [default : False]
+        primitive : bool, optional
+            Store int, float and str values with a compact text encoding
+            instead of pickle, which makes the database smaller and faster
+            for mostly numeric or short text values. Other values are still
+            pickled. Databases created without this option can be reopened
+            with it, but not the other way around.
+            [default : False]
+        serializer : str, optional
+            Serialize the values with 'pickle' or 'msgpack' (faster and
+            more compact for small values, but requires the msgpack
+            module). Values that msgpack cannot restore exactly, such as
+            tuples, are still pickled. A database must always be reopened
+            with the same serializer as when it was created.
+            [default : 'pickle']
         Returns
         -------
         out  : dict-like object.
@@ -912,6 +1703,14 @@ class sfdict(fdict):
         else:
             self.autosync = False
 
+        if 'syncinterval' in kwargs:
+            # Minimum delay in seconds between two autosyncs, to commit periodically instead of at every assignment
+            self.syncinterval = kwargs['syncinterval']
+        else:
+            self.syncinterval = 0
+        # Time of the last sync, in a list to be shared by reference with nested sfdicts (their attributes are copied from the parent)
+        self._lastsync = [time.time()]
+
         if 'writeback' in kwargs:
             # Writeback allows to monitor nested objects changes, such as list.append(), without writeback all changes must be done by direct assignment: tmp = a['a'], tmp.append(3), a['a'] = tmp
             self.writeback = kwargs['writeback']
@@ -924,56 +1723,148 @@ class sfdict(fdict):
         else:
             self.forcedumbdbm = False
 
+        if 'compress' in kwargs:
+            # Compress the values stored in the database?
+            self.compress = kwargs['compress']
+            if self.compress:
+                _CompressedShelf._get_codec(self.compress)  # check the algorithm now, before creating the database file
+        else:
+            self.compress = False
+
+        if 'primitive' in kwargs:
+            # Store primitive values without pickle?
+            self.primitive = kwargs['primitive']
+        else:
+            self.primitive = False
+
+        if 'serializer' in kwargs:
+            # Serialize the values with pickle or msgpack?
+            self.serializer = kwargs['serializer']
+            _Shelf._get_packer(self.serializer)  # check the serializer now, before creating the database file
+        else:
+            self.serializer = 'pickle'
+
         # Do we open the database in read-only mode, or do we allow write permission (and create it if necessary = c mode)?
         self.readonly = ('readonly' in kwargs)
-        if self.readonly:
-            dbflag = 'r'
-        else:
-            dbflag = 'c'
+        # Set when the database is opened, see _open_db()
+        self.usedumbdbm = False
 
-        # Initialize parent class
+        # Initialize parent class (this will create/reopen the out-of-core shelve database file, see _new_internal_dict())
         super(sfdict, self).__init__(*args, **kwargs)
 
-        # Initialize/create/reopen the out-of-core shelve database file
         if not self.rootpath: # If rootpath, this is an internal call, we just reuse the input dict
-            # Else it is an external call, we reuse the provided dict but we make a copy and store in another file, or there is no provided dict and we create a new one
-            try:
-                if self.forcedumbdbm:
-                    # Force the use of dumb dbm even if slower
-                    raise ImportError('pass')
-                d = shelve.open(filename=self.filename, flag=dbflag, protocol=PICKLE_HIGHEST_PROTOCOL, writeback=self.writeback and (not self.readonly))
-                self.usedumbdbm = False
-            except (ImportError, IOError) as exc:
-                if 'pass' in str(exc).lower() or '_bsddb' in str(exc).lower() or 'permission denied' in str(exc).lower():
-                    # Pypy error, we workaround by using a fallback to anydbm: dumbdbm
-                    if PY3:  # pragma: no cover
-                        from dbm import dumb
-                        db = dumb.open(self.filename, dbflag)
-                    else:
-                        import dumbdbm
-                        db = dumbdbm.open(self.filename, dbflag)
-                    # Open the dumb db as a shelf
-                    d = shelve.Shelf(db, protocol=PICKLE_HIGHEST_PROTOCOL, writeback=self.writeback and (not self.readonly))
-                    self.usedumbdbm = True
-                else:  # pragma: no cover
-                    raise
-
-            # Initialize the shelve with the internal (in-memory) dict preprocessed by the parent class fdict
-            d.update(self.d)
-            # Then update self.d to use the shelve instead
-            del self.d
-            self.d = d
+            # Else it is an external call
+            if not isinstance(self.d, shelve.Shelf):
+                # We were supplied a fdict, the parent class made an in-memory copy, store it in the database
+                d = self._open_db()
+                self._bulk_update(d, self._genericitems(self.d))
+                # Then update self.d to use the shelve instead
+                del self.d
+                self.d = d
             if not self.readonly:
                 self.d.sync()
 
         # Call compatibility layer
-        self._viewkeys, self._viewvalues, self._viewitems = self._getitermethods(self.d)
+        if PY3:  # pragma: no cover
+            # Py3: bind directly the internal dict's methods, same as _getitermethods() but without the call and tuple overhead
+            self._viewkeys = self.d.keys
+            self._viewvalues = self.d.values
+            self._viewitems = self.d.items
+        else:
+            self._viewkeys, self._viewvalues, self._viewitems = self._getitermethods(self.d)
+
+    def _copy_attributes(self, dst, memo=None):
+        '''Copy the settings to dst, a new sfdict created without __init__ (see fdict._copy_attributes())'''
+        if memo is None:
+            # Hot path of nested access (see _subdict()), assign the slots directly
+            dst.filename = self.filename
+            dst.autosync = self.autosync
+            dst.syncinterval = self.syncinterval
+            dst._lastsync = self._lastsync  # shared by reference, see __init__()
+            dst.writeback = self.writeback
+            dst.forcedumbdbm = self.forcedumbdbm
+            dst.compress = self.compress
+            dst.primitive = self.primitive
+            dst.serializer = self.serializer
+            dst.readonly = self.readonly
+            dst.usedumbdbm = self.usedumbdbm
+        else:
+            for name in sfdict.__slots__:
+                setattr(dst, name, deepcopy(getattr(self, name), memo))
+        if self.__dict__:
+            # Custom attributes (eg, a monkeypatched method)
+            super(sfdict, self)._copy_attributes(dst, memo)
+
+    def _new_internal_dict(self, d=None):
+        '''Create/reopen the database, and write the flattened items of the supplied nested dict directly into it, without first building an in-memory flattened copy'''
+        shelf = self._open_db()
+        if d is not None:
+            self._bulk_update(shelf, self._flatkeys_items(d, sep=self.delimiter))
+        return shelf
+
+    @staticmethod
+    def _bulk_update(shelf, items):
+        '''Store all items in the shelf with writeback temporarily disabled: the values are written directly to the database instead of also being cached in memory until the next sync(), since we will not mutate them'''
+        writeback = shelf.writeback
+        shelf.writeback = False
+        try:
+            shelf.update(items)
+        finally:
+            shelf.writeback = writeback
+
+    def _open_db(self):
+        '''Create/reopen the out-of-core shelve database file'''
+        # Do we open the database in read-only mode, or do we allow write permission (and create it if necessary = c mode)?
+        if self.readonly:
+            dbflag = 'r'
+        else:
+            dbflag = 'c'
+        try:
+            if self.forcedumbdbm:
+                # Force the use of dumb dbm even if slower
+                raise ImportError('pass')
+            import dbm
+            d = self._open_shelf(dbm.open(self.filename, dbflag))
+            self.usedumbdbm = False
+        except (ImportError, IOError) as exc:
+            if 'pass' in str(exc).lower() or '_bsddb' in str(exc).lower() or 'permission denied' in str(exc).lower():
+                # Pypy error, we workaround by using a fallback to anydbm: dumbdbm
+                if PY3:  # pragma: no cover
+                    from dbm import dumb
+                    db = dumb.open(self.filename, dbflag)
+                else:
+                    import dumbdbm
+                    db = dumbdbm.open(self.filename, dbflag)
+                # Open the dumb db as a shelf
+                d = self._open_shelf(db)
+                self.usedumbdbm = True
+            else:  # pragma: no cover
+                raise
+        return d
+
+    def _open_shelf(self, db):
+        '''Open a shelf over the supplied dbm database, compressing values if compress is enabled'''
+        writeback = self.writeback and (not self.readonly)
+        if self.compress:
+            return _CompressedShelf(db, protocol=PICKLE_HIGHEST_PROTOCOL, writeback=writeback, primitive=self.primitive, serializer=self.serializer, compress=self.compress)
+        else:
+            return _Shelf(db, protocol=PICKLE_HIGHEST_PROTOCOL, writeback=writeback, primitive=self.primitive, serializer=self.serializer)
 
     def __setitem__(self, key, value):
         super(sfdict, self).__setitem__(key, value)
+        self._autosync()
+
+    def update(self, d2):
+        '''Update with all the items of d2, and with autosync, commit them all at once: a single sync() for the whole batch instead of one per item, as it would be if the items were assigned one by one'''
+        rtncode = super(sfdict, self).update(d2)
+        self._autosync()
+        return rtncode
+
+    def _autosync(self):
+        '''Commit pending changes after an assignment if autosync is enabled, or if syncinterval is set, only if the last sync is old enough'''
         if self.autosync and not self.readonly:
-            # Commit pending changes everytime we set an item
-            self.sync()
+            if not self.syncinterval or time.time() - self._lastsync[0] >= self.syncinterval:
+                self.sync()
 
     def get_filename(self):
         return self.filename
@@ -982,19 +1873,17 @@ class sfdict(fdict):
         '''Commit pending changes to file'''
         if not self.readonly:
             self.d.sync()
+            self._lastsync[0] = time.time()
 
     def close(self, delete=False):
         '''Commit pending changes to file and close it'''
         self.d.close()
         if delete and not self.readonly:
-            try:
-                filename = self.get_filename()
-                if not self.usedumbdbm:
-                    os.remove(filename)
-                else:
-                    os.remove(filename+'.dat')
-                    os.remove(filename+'.dir')
-                    if os.path.exists(filename+'.bak'):  # pragma: no cover
-                        os.remove(filename+'.bak')
-            except Exception:  # pragma: no cover
-                pass
+            filename = self.get_filename()
+            # Remove directly all the files that the dbm backend may have created, whichever it was: dbm.open() picks the first available one (gnu or sqlite3 use the filename as-is, ndbm appends .db or .dir and .pag depending on the library, and dumb creates .dat, .dir and .bak), so usedumbdbm is not enough to know which one was used
+            # Each removal is tried separately, so that a missing file does not prevent the next ones from being removed
+            for suffix in ('', '.db', '.dat', '.dir', '.pag', '.bak'):
+                try:
+                    os.remove(filename+suffix)
+                except OSError:
+                    pass
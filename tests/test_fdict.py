@@ -4,6 +4,9 @@ import pytest
 from fdict import fdict, sfdict
 
 import ast
+import os
+import pickle
+import shelve
 import sys
 
 
@@ -26,6 +29,8 @@ def test_fdict_basic():
 
     # Test sharing of the internal dict across nested fdicts
     assert id(a.d) == id(a['c'].d)
+    assert a['c'].rootpath == 'c' and a['c']['e'].rootpath == 'c/e' and a.rootpath == ''
+    assert a['c']._viewcache is a._viewcache
 
     # Test equality
     assert a == {'c/b': set([1, 2])} and a == {'c': {'b': set([1, 2])}}  # equality dict
@@ -76,6 +81,7 @@ def test_fdict_flattening_extract_update():
     m['f'] = set([1, 2, 5])
     m2 = fdict(m)
     assert dict(m2.items()) == fdict.flatkeys(m)
+    assert fdict.flatkeys(m, prefix='x') == fdict.flatkeys({'x': m})
 
     # Update and extract test
     n = {}
@@ -91,6 +97,7 @@ def test_fdict_flattening_extract_update():
     assert len(m2) == 6
     assert len(m2['b']) == 3
     assert len(m2['b']['d']) == len(m2['b/d']) == 2
+    assert fdict._count_iter_items([1, 2, 3]) == fdict._count_iter_items(x for x in [1, 2, 3]) == 3
     assert not hasattr(m2['g'], '__len__') and isinstance(m2['g'], int)
 
 def test_fdict_extract_contains_delitem():
@@ -145,6 +152,116 @@ def test_fdict_extract_contains_delitem():
     else:
         assert False
 
+def test_fdict_contains_index(monkeypatch):
+    '''Test fdict contains of nodes with the keys index, which must be dropped on any change by all nested fdicts'''
+    from fdict.fdict import _PathIndex
+    monkeypatch.setattr(_PathIndex, 'MINSIZE', 0)  # index even this small dict
+    a = fdict({'a': {'b': {'c': 1}, 'd': 2}, 'e': 3})
+    asub = a['a']
+    assert 'a' in a and 'a/b' in a and 'b' in asub and not 'c' in asub  # build the index
+    assert a._get_index() is not None
+    assert not 'a/b/c/x' in a and not 'e/x' in a and not 'a/' in a
+    # Add leaves, both from the root and from a nested fdict
+    a['f/g'] = 4
+    asub['h'] = {'i': 5}
+    assert a._get_index() is None  # first lookup since the change, the index is not rebuilt yet
+    assert 'f' in a and 'h' in asub and 'a/h' in a
+    a.update({'j': {'k': 6}})
+    asub.update(fdict({'l': {'m': 7}}))
+    assert 'j' in a and 'l' in asub and 'a/l' in a
+    # Delete leaves and nodes, the emptied nodes should not be found anymore
+    del a['a/b/c']
+    assert not 'a/b' in a and not 'b' in asub and 'a' in a
+    del asub['h']
+    assert not 'a/h' in a
+    assert a.pop('f/g') == 4 and not 'f' in a
+    assert a.pop('j').d == {'j/k': 6} and not 'j' in a
+    assert a == {'a/d': 2, 'a/l/m': 7, 'e': 3}
+    assert 'a/l' in a
+    a.popitem()
+    a.popitem()
+    a.popitem()
+    assert not 'a' in a and not 'a/l' in a
+    # The index is rebuilt if the internal dict is replaced
+    a.d = {'x/y': 1}
+    assert 'x' in a and not 'a' in a
+
+def test_fdict_contains_subclass_viewkeys():
+    '''Test that contains() does not depend on viewkeys(), so that overriding it in a subclass does not change the nodes detection'''
+    class fdict_nokeys(fdict):
+        def viewkeys(self, *args, **kwargs):
+            return []
+    for n in [2, 200]:
+        a = fdict_nokeys({'a%d' % i: {'b': 1, 'c': 2} for i in range(n)})
+        assert list(a.viewkeys()) == []
+        for _ in range(2):  # first lookup scans, second one goes through the keys index if the fdict is big enough
+            assert 'a1' in a and 'a1/b' in a and 'x' not in a and 'b' in a['a1']
+
+def test_fdict_keys_below_index():
+    '''Test listing nested fdicts of a big fdict through the keys index'''
+    from fdict.fdict import _PathIndex
+    a = fdict({'x%d' % i: {'y': {'z': i}, 'w': -i} for i in range(100)})
+    assert dict(a['x5'].items()) == {'y/z': 5, 'w': -5}  # first lookup, scan
+    assert dict(a['x6'].items()) == {'y/z': 6, 'w': -6}  # second lookup, build the index
+    assert a._viewcache[(_PathIndex, '/')] is a._get_index()  # the index was built and cached
+    assert list(a['x5']['y'].keys()) == ['z']
+    assert list(a['x500'].keys()) == []
+    a['x5/v'] = 1
+    del a['x5/w']
+    assert dict(a['x5'].items()) == {'y/z': 5, 'v': 1}
+    assert sorted(a._get_index().keys_below('x5')) == ['x5/v', 'x5/y/z']
+    assert sorted(a._get_index().keys_below('x5/y/z')) == [] and a._get_index().has_node('x5/y') and not a._get_index().has_node('x5/y/z')
+
+def test_fdict_viewcache():
+    '''Test that the cached keys of nested fdicts are kept up-to-date by all nested fdicts'''
+    for nodel in [False, True]:
+        a = fdict({'a': {'b': {'c': 1}, 'd': 2}, 'e': 3}, nodel=nodel)
+        asub = a['a']
+        assert dict(asub.items()) == {'b/c': 1, 'd': 2}  # fill the cache
+        assert set(asub.keys()) == set(['b/c', 'd'])
+        a['a/f'] = 4
+        assert dict(asub.items()) == {'b/c': 1, 'd': 2, 'f': 4}
+        asub['d'] = 5  # values are never cached
+        assert set(asub.values()) == set([1, 5, 4])
+        asub.update({'g': {'h': 6}})
+        assert dict(a['a'].items()) == {'b/c': 1, 'd': 5, 'f': 4, 'g/h': 6}
+        if not nodel:
+            del a['a/b']
+            assert a.pop('a/f') == 4
+            assert dict(asub.items()) == {'d': 5, 'g/h': 6}
+            a.popitem()
+            assert len(asub) == 1
+
+def test_fdict_viewcache_shared_d():
+    '''Test that the cached keys are kept up-to-date with the changes made by other fdicts using the same internal dict, or directly in the internal dict'''
+    for kwargs in [{}, {'fastview': True}, {'nodel': True}]:
+        a = fdict({'x1': {'a': 1}, 'x2': 2}, **kwargs)
+        b = fdict(d=a.d, rootpath='x1', **kwargs)
+        assert list(b.keys()) == ['a']  # fill the cache
+        a['x1/b'] = 3
+        assert sorted(b.keys()) == ['a', 'b'] and 'b' in b
+        b['c/d'] = 4
+        assert 'x1/c' in a and dict(a['x1'].items()) == {'a': 1, 'b': 3, 'c/d': 4}
+        acopy = a.copy()
+        acopy['x1/e'] = 5
+        assert 'x1/e' in acopy and 'x1/e' not in a and sorted(b.keys()) == ['a', 'b', 'c/d']
+
+    # Big fdict, with the keys index built
+    y = fdict({'k%d' % i: {'x': i} for i in range(100)})
+    assert 'k1' in y and 'k1' in y
+    assert y._get_index() is not None
+    x = fdict()
+    x.d = y.d
+    x['new/leaf'] = 1
+    x['k1/extra'] = 2
+    assert 'new' in y and sorted(y['k1'].keys()) == ['extra', 'x']
+    # Direct change of the internal dict
+    y.d['k1/y'] = 5
+    assert sorted(y['k1'].keys()) == ['extra', 'x', 'y'] and 'k1/y' in y
+    del y.d['k2/x']
+    y.d['k3/z'] = 6  # same size, but another last key
+    assert 'k2' not in y and sorted(y['k3'].keys()) == ['x', 'z']
+
 def test_fdict_update_eq():
     '''Update test and equality test'''
     a1 = {'a': set([1, 2]), 'b': {'c': 3, 'c2': 4}, 'd': 4}
@@ -175,6 +292,8 @@ def test_fdict_update_eq():
     assert a22 == {'a': set([1, 2]), 'b/c': 4, 'b/c2': 4, 'b/c3': 3, 'd': 4}
     assert a22 == a12
     assert len(a22) == 5 # len() test
+    assert not fdict({'a/b': 1, 'x': 1}) == {'a/b': 1, 'a': {'b': 1}} # a dict can flatten to the same key twice, it must not count as two leaves
+    assert fdict({'a/b': 1}) == {'a/b': 1, 'a': {'b': 1}}
 
     # update of a subdict with a whole dict (extracted subdict)
     a13['b'].update(b1['b'])
@@ -245,6 +364,10 @@ def test_fdict_setitem_nesteddict():
     # Test root fdict to sub fdict assignment
     a3['a']['c'] = b
     assert a3.d == {'a/c/subelements/f/g': 1, 'a/c/subelements/e': 1, 'a/c/x/y/subelements/f/g': -2, 'a/c/x/y/subelements/e': -2}
+    # Test fdict to sub fastview fdict assignment, metadata must be built as for a normal dict
+    a = fdict(fastview=True)
+    a['a']['c'] = fdict({'subelements': {'e': 1, 'f': {'g': 1}}})
+    assert a.d == {'a/c/subelements/f/g': 1, 'a/c/subelements/e': 1, 'a/': set(['a/c/']), 'a/c/': set(['a/c/subelements/']), 'a/c/subelements/': set(['a/c/subelements/e', 'a/c/subelements/f/']), 'a/c/subelements/f/': set(['a/c/subelements/f/g'])}
     # Test nested normal dict to sub fdict assignment
     a = fdict()
     a['a']['c'] = {'subelements': {'e': 1, 'f': {'g': 1}}}
@@ -321,6 +444,17 @@ def test_fdict_init_fdict():
     b = fdict(a)
     assert b == a
     assert id(b.d) != id(a.d)
+    # Nested fdict: only its leaves are copied, relative to its rootpath
+    assert fdict(a['a']).d == {'b': 1, 'c': set([1, 2])}
+    # Different modes or delimiter: the nodes are rebuilt, not copied as leaves
+    af = fdict(a, fastview=True)
+    assert af.d == {'a/b': 1, 'a/c': set([1, 2]), 'a/': set(['a/b', 'a/c'])}
+    assert fdict(af).d == {'a/b': 1, 'a/c': set([1, 2])}
+    assert fdict(a, delimiter='.').d == {'a.b': 1, 'a.c': set([1, 2])}
+    # Out-of-core fdict
+    g = sfdict(a)
+    assert fdict(g).d == a.d
+    g.close(delete=True)
 
 def test_fdict_init_tuples():
     '''Test fdict init with a non-dict object (eg, list of tuples)'''
@@ -525,6 +659,9 @@ def test_fdict_eq_extended():
     assert a != {'a': 1}
     assert a != fdict({'a': 1})
     assert a['a'] != fdict({'b': 1, 'c': 2, 'e': 4})
+    assert a != {'a': {'b': 1}, 'd': 3}  # all leaves of d2 are in a, but a has more
+    assert a['a'] != {'b': 1, 'c': 2, 'e': 4}
+    assert dict(fdict._flatkeys_items({'a': {'b': 1}, 'c': 2, 3: 4})) == fdict.flatkeys({'a': {'b': 1}, 'c': 2, 3: 4})
     # Unequal by value
     assert a != {'a': {'b': 1, 'c': 2}, 'd': -1}
     assert a != {'a': {'b': 1, 'c': -1}, 'd': 3}
@@ -538,6 +675,18 @@ def test_fdict_eq_extended():
     assert a['a'] == fdict({'b': 1, 'c': 2}, fastview=True)
     assert a == sfdict({'a': {'b': 1, 'c': 2}, 'd': 3})
     assert a['a'] == sfdict({'b': 1, 'c': 2})
+    # Unequal by size with different modes (len() counts only the leaves in all modes)
+    b = fdict({'a': 1, 'b/c': 2}, fastview=True)
+    assert b != fdict({'a': 1}) and fdict({'a': 1}) != b
+    assert b['b'] == b['b']  # same view of the same internal dict
+    # Out-of-core dicts are compared without building temporary in-memory dicts
+    g = sfdict({'a': {'b': 1, 'c': 2}, 'd': 3})
+    h = sfdict({'a': {'b': 1, 'c': 2}, 'd': 3})
+    assert g == h
+    h['d'] = 4
+    assert g != h
+    g.close(delete=True)
+    h.close(delete=True)
 
 def test_fdict_not():
     '''Test fdict truth value (not d)'''
@@ -568,6 +717,14 @@ def test_fdict_pop_popitem():
     assert a == {'d': 3}
     inexistent = a.pop('e', 'inexistent!')
     assert inexistent == 'inexistent!'
+    # pop nodes of a bigger dict (walked with the keys index)
+    b = fdict(dict(('k%d' % i, {'x': i, 'y': {'z': i}}) for i in range(100)))
+    assert set(b['k5'].keys()) == set(['x', 'y/z'])  # cache the keys below k5
+    node = b.pop('k5')
+    assert node.d == {'k5/x': 5, 'k5/y/z': 5} and node.rootpath == 'k5'
+    assert 'k5' not in b and len(b) == 198 and list(b['k5'].keys()) == []
+    assert b.pop('k5', 'inexistent!') == 'inexistent!'
+    assert b.pop('k6', fullpath=False).d == {'x': 6, 'y/z': 6}
 
 
     a2.popitem()
@@ -587,6 +744,13 @@ def test_fdict_get_root_parent_node():
     rootpath='a/b'
     assert fdict._get_root_parent_node(path, delimiter='/', rootpath=rootpath) == 'a/b/c'
 
+def test_fdict_get_all_parent_nodes():
+    '''Test fdict _get_all_parent_nodes()'''
+    assert fdict._get_all_parent_nodes('a/b/c', delimiter='/') == ['a/b/', 'a/']
+    assert fdict._get_all_parent_nodes('a/b/', delimiter='/') == ['a/b/', 'a/']
+    assert fdict._get_all_parent_nodes('a', delimiter='/') == []
+    assert fdict._get_all_parent_nodes('a::b::c', delimiter='::') == ['a::b::', 'a::']
+
 def test_fdict_viewrestrict():
     '''Test fdict view*_restrict methods'''
     a = fdict({'a': {'b': {'c': 1, 'd': 2}, 'e': 3}, 'f': 4})
@@ -644,6 +808,13 @@ def test_fdict_fastview_basic():
     assert list(a['j'].keys()) == []
     assert list(a['j'].values()) == []
 
+    # test fastview len (counts all nested leaves, not just direct children)
+    assert len(a) == 5
+    assert len(a['a']) == 5
+    assert len(a['a']['e']) == 3
+    assert len(a['a/e/g']) == 2
+    assert len(a['j']) == 0
+
     # test fastview contains
     assert 'a' in a
     assert 'a/' in a
@@ -658,10 +829,20 @@ def test_fdict_fastview_basic():
     from copy import deepcopy
     assert a.d == {'a/e/g/': set(['a/e/g/i', 'a/e/g/h']), 'a/e/f': 3, 'a/e/': set(['a/e/g/', 'a/e/f']), 'a/': set(['a/e/', 'a/b/']), 'a/b/c': 1, 'a/b/d': 2, 'a/b/': set(['a/b/c', 'a/b/d']), 'a/e/g/i': 5, 'a/e/g/h': 4}
     a2 = a.copy()
-    for k in a.d.keys():
-        if k.endswith(a.delimiter):
-            # all nodes should be copied as different objects
-            assert id(a.d[k]) != id(a2.d[k])
+    # nodes sets are copied lazily (copy-on-write): modifying the copy should not modify the original, and vice-versa
+    assert a2.d == a.d
+    del a2['a/e/g/h']
+    assert a2.d['a/e/g/'] == set(['a/e/g/i'])
+    assert a.d['a/e/g/'] == set(['a/e/g/i', 'a/e/g/h'])
+    a2['a/b/x'] = 6
+    assert a2.d['a/b/'] == set(['a/b/c', 'a/b/d', 'a/b/x'])
+    assert a.d['a/b/'] == set(['a/b/c', 'a/b/d'])
+    a4 = a.copy()
+    del a['a/e/f']
+    a.popitem()
+    assert a4.d['a/e/'] == set(['a/e/g/', 'a/e/f'])
+    assert len(a4) == 5
+    a = a4
     # test deepcopy
     if sys.version_info >= (2,7):
         a3 = deepcopy(a)
@@ -676,6 +857,12 @@ def test_fdict_fastview_basic():
         b = fdict({'a': {'b': 1, 'c': set([1, 2])}, 'd': 3}, delimiter='.', fastview=True)
         bsub = deepcopy(b['a'])
         assert bsub == b['a']
+    # test deepcopy keeps the sharing with the objects copied along (memo)
+    l = [1]
+    c = deepcopy([fdict({'x': l, 'y': l}), l])
+    assert c[0]['x'] is c[1] and c[0]['y'] is c[1] and c[1] is not l
+    c = deepcopy(fdict({'x': l, 'y': l}))
+    assert c['x'] is c['y'] and c['x'] is not l
 
 def test_fdict_fastview_del():
     '''Test fastview del'''
@@ -697,12 +884,76 @@ def test_fdict_fastview_del():
     assert not set(a['a/e'].keys()) and not dict(a2['a']['e'])
     assert set(a['a'].keys(fullpath=True, nodes=True)) == set(['a/b/', 'a/b/d', 'a/b/c'])
 
+def test_fdict_fastview_copy():
+    '''Test that fastview copies share the nodes sets until they are modified, and that the nodes created after a copy are not copied again'''
+    a = fdict({'a': {'b': 1, 'c': {'d': 2}}}, fastview=True)
+    asub = a['a']['c'].copy()
+    assert asub.rootpath == 'a/c' and dict(asub.items()) == {'d': 2}
+    a2 = a.copy()
+    assert a2.d == a.d and a2.d is not a.d
+    assert a2.d['a/'] is a.d['a/']  # shared until modified
+    a2['a/e'] = 3
+    assert a2.d['a/'] is not a.d['a/'] and 'a/e' not in a.d['a/']
+    assert a2.d['a/c/'] is a.d['a/c/']  # unmodified node, still shared
+    # New nodes after a copy are owned, so they are not copied on their next changes
+    a2['x/y'] = 4
+    xset = a2.d['x/']
+    a2['x/z'] = 5
+    a2.update({'w': {'v': 6}})
+    wset = a2.d['w/']
+    a2['w/u'] = 7
+    assert a2.d['x/'] is xset and a2.d['w/'] is wset
+    assert a == {'a/b': 1, 'a/c/d': 2}
+    assert a2 == {'a/b': 1, 'a/c/d': 2, 'a/e': 3, 'x/y': 4, 'x/z': 5, 'w/v': 6, 'w/u': 7}
+
 def test_fdict_fastview_metadata_nested_dict():
     '''Test fastview nodes metadata creation with nested dicts and at creation'''
     a = fdict({'a/b': 1, 'a/c': set([1,2,3]), 'd': [1, 2, 3]}, fastview=True)
     # add nested dict
     a['g'] = {'h': {'i': {'j': 6}, 'k': 7}, 'l': 8}
     assert a.d == {'g/l': 8, 'g/h/i/j': 6, 'g/h/i/': set(['g/h/i/j']), 'a/': set(['a/b', 'a/c']), 'a/c': set([1, 2, 3]), 'a/b': 1, 'g/h/': set(['g/h/k', 'g/h/i/']), 'g/': set(['g/l', 'g/h/']), 'g/h/k': 7, 'd': [1, 2, 3]}
+    # multi-characters delimiter, in fastview and nodel modes
+    a = fdict({'a': {'b': {'c': 1}, 'd': 2}}, delimiter='::', fastview=True)
+    assert a.d == {'a::b::c': 1, 'a::d': 2, 'a::b::': set(['a::b::c']), 'a::': set(['a::b::', 'a::d'])}
+    a = fdict({'a': {'b': {'c': 1}, 'd': 2}}, delimiter='::', nodel=True)
+    a.update({'a': {'b': {'e': 3}}, 'f': {'g': 4}})  # parents already existing are not recreated
+    assert a.d == {'a::b::c': 1, 'a::d': 2, 'a::b::e': 3, 'f::g': 4, 'a::b::': None, 'a::': None, 'f::': None}
+
+def test_fdict_multichar_delimiter():
+    '''Test fdict with a multi-characters delimiter in all modes (nodes end with the whole delimiter)'''
+    assert fdict._get_parent_node('a::b::c', delimiter='::') == 'a::b::'
+    assert fdict._get_parent_node('a::b::', delimiter='::') == 'a::'
+    assert fdict._get_parent_node('a', delimiter='::') == ''
+    assert fdict._get_root_parent_node('a::b::c::d', delimiter='::', rootpath='a::b') == 'a::b::c'
+    assert list(fdict._get_all_parent_nodes_nested('a::b::c', delimiter='::')) == ['a', 'b']
+    for kwargs in [{}, {'fastview': True}, {'nodel': True}]:
+        a = fdict({'a': {'x': {'y': 2, 'z': 3}}, 'c': 4}, delimiter='::', **kwargs)
+        a['a']['c'] = 2
+        if not kwargs.get('nodel'):  # delitem is disabled in nodel mode
+            a['a']['b'] = 1
+            del a['a']['b']
+        assert set(a.keys()) == set(['a::x::y', 'a::x::z', 'a::c', 'c'])
+        assert len(a) == 4 and len(a['a']) == 3 and len(a['a']['x']) == 2
+        assert set(a['a'].keys()) == set(['x::y', 'x::z', 'c'])
+        assert dict(a['a'].items()) == {'x::y': 2, 'x::z': 3, 'c': 2}
+        assert 'x' in a['a'] and 'a::x' in a and not 'q' in a['a']
+        b = a.copy()
+        b['a::x::w'] = 5
+        assert set(a.keys()) == set(['a::x::y', 'a::x::z', 'a::c', 'c'])
+        assert set(b.keys()) == set(['a::x::y', 'a::x::z', 'a::x::w', 'a::c', 'c'])
+        if not kwargs.get('nodel'):
+            del b['a']['x']['y']
+            assert set(b.keys()) == set(['a::x::z', 'a::x::w', 'a::c', 'c'])
+            assert set(a.keys()) == set(['a::x::y', 'a::x::z', 'a::c', 'c'])
+        if kwargs:
+            assert set(a.keys(nodes=True)) == set(['a::', 'a::x::', 'a::x::y', 'a::x::z', 'a::c', 'c'])
+        if kwargs.get('fastview'):
+            assert a.d['a::'] == set(['a::x::', 'a::c']) and b.d['a::x::'] == set(['a::x::z', 'a::x::w'])
+            # replace a node by a leaf, and a leaf by a node
+            a['a']['x'] = 7
+            a['c::d'] = 8
+            assert a == {'a::x': 7, 'a::c': 2, 'c::d': 8}
+            assert a.d['a::'] == set(['a::x', 'a::c']) and 'a::x::' not in a.d
 
 def test_fdict_fastview_setitem_noconflict_delitem():
     '''Test fdict fastview setitem replacement of singleton by nested dict and inversely + delitem'''
@@ -722,6 +973,10 @@ def test_fdict_fastview_setitem_noconflict_delitem():
     # delitem nested dict
     del a['d']
     assert a.d == {'a': 2, 'g/l': 8, 'g/h/': set(['g/h/k']), 'g/': set(['g/l', 'g/h/']), 'g/h/k': 7}
+    # singleton to nested dict in a nested fdict
+    a = fdict({'x': {'a': 1}}, fastview=True)
+    a['x']['a/b'] = 2
+    assert a.d == {'x/a/b': 2, 'x/a/': set(['x/a/b']), 'x/': set(['x/a/'])}
 
 def test_fdict_fastview_delitem():
     '''Test fdict fastview delitem'''
@@ -806,10 +1061,7 @@ def test_fdict_nodel_basic():
     assert dict(a['a'].items()) == {'c': 2, 'b': 1, 'd/e': 3}
     assert dict(a['a'].items(nodes=True)) == {'d/': None, 'c': 2, 'b': 1, 'd/e': 3}
 
-    # Test normal fdict stripped of viewkeys(), should not detect nodes anymore
-    a = fdict({'a': {'b': 1, 'c': 2}}, nodel=False)
-    a.viewkeys = lambda *args, **kwargs: []
-    assert not ('a' in a)
+    # Note: the former test that a normal fdict stripped of viewkeys() does not detect nodes anymore was dropped, since contains() now walks the internal dict directly instead of going through viewkeys() (see test_fdict_contains_subclass_viewkeys())
 
     # Test nodel fdict, stripped of viewkeys() it will still find nodes (because nodes are signalled by creating an empty key)
     a = fdict({'a': {'b': 1, 'c': 2}}, nodel=True)
@@ -864,6 +1116,8 @@ def test_sfdict_basic():
     assert g == {'a': 3, 'b/c': set([1, 3, 4])}
     assert g == {'a': 3, 'b/c': set([1, 3, 4]), 'd': {}} # empty dicts are stripped out before comparison
     assert g['b'].filename == g.filename # check that subdicts also share the same filename (parameters propagation)
+    assert g['b'].writeback == g.writeback and g['b']._lastsync is g._lastsync and not g['b'].__dict__  # all settings propagate, in slots
+    assert 'b' in g and 'c' in g['b'] and not 'x' in g and not 'b' in g['b']  # nested contains on an out-of-core dict (keys scan)
     g.sync()  # commit the changes
     g2 = g.to_dict()  # copy before close, to test later
     g.close()  # close database (without deleting), otherwise we cannot reopen it, there will be a lock. TODO: if there is ever an issue, maybe implement a mutex, but it needs to be managed manually by user, otherwise it will be toooo slow to do it automatically on each sync, I tried: https://stackoverflow.com/questions/52381091/resource-temporarily-unavailable-on-python-shelve-open
@@ -872,6 +1126,7 @@ def test_sfdict_basic():
     h = sfdict(filename='testshelf')
     assert h == g2
     h.close(delete=True)  # close database with deletion, we are done
+    assert not [f for f in os.listdir('.') if f == 'testshelf' or f.startswith('testshelf.')]  # all the database files were removed, whichever dbm backend created them
 
 def test_sfdict_dictinit():
     '''Test sfdict initialization with a dict'''
@@ -879,6 +1134,14 @@ def test_sfdict_dictinit():
     assert g == {'a/b': set([1, 2])}
     assert id(g.d) == id(g['a'].d)  # ensure the same dict is shared with nested sfdict
     g.close(delete=True)
+    # init with a fdict or with fastview metadata
+    h = sfdict(d=fdict({'a': {'b': 1}}))
+    assert not h.d.cache and h.d.writeback  # initial items are not kept in the writeback cache
+    assert h == {'a/b': 1}
+    h.close(delete=True)
+    h = sfdict(d={'a': {'b': 1, 'c': {'d': 2}}}, fastview=True)
+    assert dict(h.d) == {'a/b': 1, 'a/c/d': 2, 'a/': set(['a/b', 'a/c/']), 'a/c/': set(['a/c/d'])}
+    h.close(delete=True)
 
 def test_sfdict_forcedbm_filename():
     '''Test sfdict forcedbm=True and get_filename()'''
@@ -897,7 +1160,7 @@ def test_sfdict_autosync():
     '''Test sfdict autosync'''
     ## TEST1: With autosync, updating a nested object is saved to disk
     g = sfdict(d={'a': {'b': set([1, 2])}}, autosync=True)
-    assert 'shelve' in str(type(g.d)) or 'instance' in str(type(g.d))  # check the internal dict is a db shelve
+    assert isinstance(g.d, shelve.Shelf)  # check the internal dict is a db shelve
     g['a']['b'].add(3)
     assert g['a/b'] == set([1, 2, 3])
     g['d'] = 4  # trigger the autosync on setitem
@@ -939,6 +1202,32 @@ def test_sfdict_autosync():
     h = sfdict(filename=filename)
     assert h == {'a/b': set([1, 2, 3]), 'd': 4}  # then we find the data is there!
     h.close(delete=True)
+    ## TEST3: With autosync, update() commits all the items at once
+    g = sfdict(autosync=True)
+    syncs = []
+    sync = g.sync
+    g.sync = lambda: syncs.append(1) or sync()
+    g.update({'a': {'b': 1, 'c': 2}, 'd': 3})
+    assert len(syncs) == 1
+    assert g == {'a/b': 1, 'a/c': 2, 'd': 3}
+    g.close(delete=True)
+    ## TEST4: With autosync and syncinterval, assignments sync only if the last sync is old enough
+    g = sfdict(autosync=True, syncinterval=3600)
+    syncs = []
+    sync = g.sync
+    g.sync = lambda: syncs.append(1) or sync()
+    g['a'] = 1
+    g['b']['c'] = 2  # nested sfdicts share the time of the last sync
+    assert len(syncs) == 0
+    g._lastsync[0] -= 3600
+    g['b']['d'] = 3
+    g['e'] = 4
+    assert len(syncs) == 1
+    filename = g.get_filename()
+    g.close()  # pending changes are committed on close
+    h = sfdict(filename=filename)
+    assert h == {'a': 1, 'b/c': 2, 'b/d': 3, 'e': 4}
+    h.close(delete=True)
 
 def test_sfdict_writeback():
     '''Test sfdict writeback'''
@@ -968,7 +1257,7 @@ def test_sfdict_readonly():
     '''Test sfdict readonly'''
     ## TEST1: With autosync, updating a nested object is saved to disk
     g = sfdict(d={'a': {'b': set([1, 2])}}, autosync=True)
-    assert 'shelve' in str(type(g.d)) or 'instance' in str(type(g.d))  # check the internal dict is a db shelve
+    assert isinstance(g.d, shelve.Shelf)  # check the internal dict is a db shelve
     g['a']['b'].add(3)
     assert g['a/b'] == set([1, 2, 3])
     g['d'] = 4  # trigger the autosync on setitem
@@ -987,3 +1276,66 @@ def test_sfdict_readonly():
     # Delete test file
     g = sfdict(filename=filename)
     g.close(delete=True)
+
+def _check_sfdict_compress(compress):
+    g = sfdict(d={'a': {'b': set([1, 2])}}, compress=compress)
+    g['c'] = 'x' * 1000
+    filename = g.get_filename()
+    assert g == {'a/b': set([1, 2]), 'c': 'x' * 1000}
+    assert len(g.d.dict[b'c']) < 1000  # values are compressed in the database
+    g.close()
+    # Reopen the compressed database
+    h = sfdict(filename=filename, compress=compress)
+    assert h == {'a/b': set([1, 2]), 'c': 'x' * 1000}
+    h.close(delete=True)
+
+def test_sfdict_compress():
+    '''Test sfdict compress'''
+    for compress in ['zlib', True]:
+        _check_sfdict_compress(compress)
+    with pytest.raises(ValueError):
+        sfdict(compress='unknown')
+
+def test_sfdict_compress_zstd():
+    '''Test sfdict compress with zstd (optional dependency)'''
+    pytest.importorskip('zstandard')
+    _check_sfdict_compress('zstd')
+
+def test_sfdict_primitive():
+    '''Test sfdict primitive values encoding'''
+    for compress in [False, 'zlib']:
+        values = {'i': -42, 'f': 1.5, 's': u'été', 'b': True, 'n': None, 'l': [1, 2], 'e': ''}
+        g = sfdict(d={'a': values}, primitive=True, compress=compress)
+        filename = g.get_filename()
+        assert g['a'] == values
+        assert type(g['a/b']) is bool and type(g['a/f']) is float
+        if not compress:
+            assert g.d.dict[b'a/i'] == b'i-42'  # primitive values are not pickled
+        g.close()
+        # Reopen the database
+        h = sfdict(filename=filename, primitive=True, compress=compress)
+        assert h == {'a': values}
+        h['big'] = 10**5000  # too many digits for str(), pickled instead
+        assert h['big'] == 10**5000
+        with pytest.raises((pickle.PicklingError, AttributeError)):
+            h['f'] = lambda: 1  # cannot be serialized...
+        h.sync()  # ... so it must not be left in the writeback cache
+        h.close(delete=True)
+
+def test_sfdict_serializer():
+    '''Test sfdict msgpack serializer (optional dependency)'''
+    with pytest.raises(ValueError):
+        sfdict(serializer='unknown')
+    pytest.importorskip('msgpack')
+    for primitive in [False, True]:
+        values = {'i': -42, 'f': 1.5, 's': u'été', 'b': True, 'n': None, 'l': [1, [2]], 'm': {1: 'x'}, 'e': {}, 'set': set([1, 2]), 't': (1, 2), 'big': 2**70, 'by': b'xy'}
+        g = sfdict(d={'a': values}, primitive=primitive, serializer='msgpack')
+        filename = g.get_filename()
+        assert g['a'] == values
+        assert type(g['a/t']) is tuple and type(g['a/set']) is set  # types unsupported by msgpack are restored exactly
+        assert g.d.dict[b'a/l'][:1] == b'm' and g.d.dict[b'a/t'][:1] == b'\x80'  # msgpack with pickle fallback
+        g.close()
+        # Reopen the database
+        h = sfdict(filename=filename, primitive=primitive, serializer='msgpack')
+        assert h == {'a': values}
+        h.close(delete=True)